@@ -0,0 +1,173 @@
+"""
+Local fake news website used by the benchmarks, it generates the RSS feeds, the articles and the images of many channels
+without any network. Some channels answer with errors or slowly, to measure their cost.
+
+    /feed/<channel>.xml            RSS feed of the channel, `items_per_feed` items, supports ETag (304)
+    /article/<channel>/<item>.html article page, its image is in `og:image` or only in the body
+    /image/<number>.png            image, `images` different images shared by all the articles
+"""
+import random
+import struct
+import threading
+import time
+import zlib
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_png(number: int) -> bytes:
+    """A small valid PNG, different for every number"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    pixel = number.to_bytes(3, 'big')
+    raw = b''.join(b'\x00' + pixel * 8 for _ in range(8))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 8, 8, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+class FakeSite:
+    """
+    The settings of the website, every channel has a behaviour chosen by the ratios: 'ok', '403', '404', '5xx' or 'slow'.
+    `cycle` change the items of the feeds, `new_items` new items are published every cycle.
+    """
+    def __init__(self, channels: int = 20, items_per_feed: int = 30, new_items: int = 5, thumbnails: float = 0.5,
+                 images: int = 50, article_size: int = 100 * 1024, slow_delay: float = 0.5, ratios: dict = None,
+                 seed: int = 1):
+        self.channels = channels
+        self.items_per_feed = items_per_feed
+        self.new_items = new_items
+        self.thumbnails = thumbnails
+        self.article_size = article_size
+        self.slow_delay = slow_delay
+        self.cycle = 0
+        self.images = [make_png(number) for number in range(images)]
+        ratios = ratios or {}
+        behaviours = []
+        for behaviour in ('403', '404', '5xx', 'slow'):
+            behaviours += [behaviour] * round(ratios.get(behaviour, 0) * channels)
+        behaviours += ['ok'] * (channels - len(behaviours))
+        random.Random(seed).shuffle(behaviours)
+        self.behaviours = behaviours[:channels]
+        # number of responses by path type and status code: {'feed 200': n, ...}
+        self.requests: dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self, host: str = '127.0.0.1', port: int = 0):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                site.handle(self)
+
+            def log_message(self, format_, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="FakeSite", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def count(self, kind: str, status: int):
+        with self.lock:
+            key = f"{kind} {status}"
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def items(self, channel: int) -> range:
+        """The items of the feed of the channel in the current cycle, the newest first"""
+        last = self.items_per_feed + self.cycle * self.new_items
+        return range(last - 1, last - 1 - self.items_per_feed, -1)
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        parts = request.path.strip('/').split('/')
+        try:
+            if parts[0] == 'feed' and len(parts) == 2:
+                self.__feed(request, int(parts[1].split('.')[0]))
+            elif parts[0] == 'article' and len(parts) == 3:
+                self.__article(request, int(parts[1]), int(parts[2].split('.')[0]))
+            elif parts[0] == 'image' and len(parts) == 2:
+                image = self.images[int(parts[1].split('.')[0]) % len(self.images)]
+                self.__send(request, 'image', 200, image, 'image/png')
+            else:
+                self.__send(request, 'other', 404, b'not found', 'text/plain')
+        except (ValueError, IndexError):
+            self.__send(request, 'other', 404, b'not found', 'text/plain')
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped the download (the image of the article is found)
+            pass
+
+    def __send(self, request, kind: str, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.count(kind, status)
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def __error(self, request, kind: str, behaviour: str) -> bool:
+        """Send the error of the channel, :return: True if the response is sent"""
+        if behaviour == 'slow':
+            time.sleep(self.slow_delay)
+        elif behaviour in ('403', '404'):
+            self.__send(request, kind, int(behaviour), b'error', 'text/html')
+            return True
+        elif behaviour == '5xx':
+            self.__send(request, kind, 503, b'error', 'text/html', {'Retry-After': '1'})
+            return True
+        return False
+
+    def __feed(self, request, channel: int):
+        if channel >= self.channels or self.__error(request, 'feed', self.behaviours[channel]):
+            if channel >= self.channels:
+                self.__send(request, 'feed', 404, b'not found', 'text/plain')
+            return
+        etag = f'"{channel}-{self.cycle}"'
+        if request.headers.get('If-None-Match') == etag:
+            self.__send(request, 'feed', 304, b'', 'application/rss+xml', {'ETag': etag})
+            return
+        now = time.time()
+        items = []
+        newest = self.items(channel)[0]
+        for item in self.items(channel):
+            link = f"{self.url}article/{channel}/{item}.html"
+            thumbnail = f'<media:thumbnail url="{self.url}image/{item}.png"/>' \
+                if random.Random(channel * 100003 + item).random() < self.thumbnails else ''
+            items.append(
+                f"<item><title>Channel {channel} news {item}</title><link>{link}</link><guid>{link}</guid>"
+                f"<description><![CDATA[<p>The summary of the news {item} of the channel {channel}.</p>]]>"
+                f"</description><pubDate>{formatdate(now - (newest - item) * 600)}"
+                f"</pubDate>{thumbnail}</item>")
+        body = ('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0" xmlns:media="http://search.yahoo.com/mrss/">'
+                f'<channel><title>Channel {channel}</title><link>{self.url}</link><ttl>5</ttl>'
+                + ''.join(items) + '</channel></rss>').encode()
+        self.__send(request, 'feed', 200, body, 'application/rss+xml', {'ETag': etag})
+
+    def __article(self, request, channel: int, item: int):
+        if channel < self.channels and self.__error(request, 'article', self.behaviours[channel]):
+            return
+        image = f"{self.url}image/{item}.png"
+        # half of the articles have their image only in the body, after the text
+        in_head = item % 2 == 0
+        head = f'<meta property="og:image" content="{image}">' if in_head else ''
+        paragraph = f"<p>The text of the news {item} of the channel {channel}, lorem ipsum dolor sit amet.</p>"
+        text = paragraph * max(self.article_size // len(paragraph), 1)
+        body = (f"<html><head><title>News {item}</title>{head}</head><body><h1>News {item}</h1>"
+                f"{text}<img src=\"{image}\"></body></html>").encode()
+        self.__send(request, 'article', 200, body, 'text/html; charset=utf-8')
@@ -0,0 +1,127 @@
+"""
+Compare the time of `FeedParser` (lxml) and `feedparser` on recorded feeds.
+
+    python -m benchmarks.parsers                      # the feeds of benchmarks/feeds/, generated if empty
+    python -m benchmarks.parsers --record             # record the feeds of the channels of main.py
+    python -m benchmarks.parsers feed.xml feeds/ -r 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+import feedparser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.feed_parser import FeedParser
+
+FEEDS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feeds')
+EXTENSIONS = ('.xml', '.rss', '.atom')
+
+
+def generate_feeds(directory: str, number_of_items: int = 500):
+    """Write an RSS and an Atom feed with `number_of_items` items, used when no feed is recorded"""
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    items = []
+    entries = []
+    for i in range(number_of_items):
+        date = now - timedelta(minutes=i * 7)
+        description = f"<p>Summary of the news {i} &amp; some <b>HTML</b> " + "lorem ipsum " * 40 + "</p>"
+        items.append(
+            f"<item><title>News {i}: the title of the news</title><link>https://www.example.com/news/{i}</link>"
+            f"<description><![CDATA[{description}]]></description><pubDate>{format_datetime(date)}</pubDate>"
+            f"<guid>https://www.example.com/news/{i}</guid>"
+            f"<media:thumbnail url=\"https://www.example.com/images/{i}.jpg\"/></item>")
+        entries.append(
+            f"<entry><title>News {i}</title><link href=\"https://www.example.com/news/{i}\"/>"
+            f"<id>https://www.example.com/news/{i}</id><published>{date.isoformat()}</published>"
+            f"<summary type=\"html\">{description.replace('&', '&amp;').replace('<', '&lt;')}</summary></entry>")
+    with open(os.path.join(directory, 'generated.rss'), 'w', encoding='utf-8') as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0" '
+                   'xmlns:media="http://search.yahoo.com/mrss/"><channel><title>Generated</title><ttl>15</ttl>'
+                   + ''.join(items) + '</channel></rss>')
+    with open(os.path.join(directory, 'generated.atom'), 'w', encoding='utf-8') as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom">'
+                   '<title>Generated</title>' + ''.join(entries) + '</feed>')
+
+
+async def record_feeds(directory: str):
+    """Download the feeds of the channels of main.py"""
+    import httpx
+    from main import channels
+    os.makedirs(directory, exist_ok=True)
+    async with httpx.AsyncClient(follow_redirects=True, timeout=30) as client:
+        for name, channel in channels.items():
+            try:
+                response = await client.get(channel['rss_url'])
+            except httpx.HTTPError as e:
+                print(f"{name}: {e}")
+                continue
+            if response.status_code == 200:
+                with open(os.path.join(directory, f"{name}.xml"), 'wb') as file:
+                    file.write(response.content)
+            print(f"{name}: {response.status_code}, {len(response.content)} bytes")
+
+
+def find_feeds(paths: list[str]) -> list[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(EXTENSIONS)))
+        elif os.path.isfile(path):
+            files.append(path)
+        elif path != FEEDS_DIRECTORY:
+            # the feeds directory is created when the feeds are generated or recorded
+            print(f"{path}: no such file or directory, skipped")
+    return files
+
+
+def best_time(parse, content: bytes, repeat: int):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = parse(content)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the lxml feed parser and feedparser")
+    parser.add_argument('paths', nargs='*', default=[FEEDS_DIRECTORY], help="feed files or directories")
+    parser.add_argument('-r', '--repeat', type=int, default=10, help="number of runs, the best time is kept")
+    parser.add_argument('--record', action='store_true', help="record the feeds of the channels of main.py")
+    parser.add_argument('--items', type=int, default=500, help="number of items of the generated feeds")
+    args = parser.parse_args()
+    if args.record:
+        asyncio.run(record_feeds(FEEDS_DIRECTORY))
+    files = find_feeds(args.paths)
+    if not files and args.paths == [FEEDS_DIRECTORY]:
+        generate_feeds(FEEDS_DIRECTORY, args.items)
+        files = find_feeds([FEEDS_DIRECTORY])
+    if not files:
+        sys.exit("No feed to parse")
+    total_lxml = total_feedparser = 0
+    print(f"{'feed':<30} {'bytes':>9} {'entries':>8} {'lxml ms':>9} {'feedparser ms':>14} {'speedup':>8}")
+    for path in files:
+        with open(path, 'rb') as file:
+            content = file.read()
+        lxml_time, lxml_result = best_time(lambda data: FeedParser.parse(data, 'lxml'), content, args.repeat)
+        feedparser_time, feedparser_result = best_time(feedparser.parse, content, args.repeat)
+        total_lxml += lxml_time
+        total_feedparser += feedparser_time
+        entries = f"{len(lxml_result.entries)}" if len(lxml_result.entries) == len(feedparser_result.entries) else \
+            f"{len(lxml_result.entries)}!={len(feedparser_result.entries)}"
+        print(f"{os.path.basename(path)[:30]:<30} {len(content):>9} {entries:>8} {lxml_time * 1000:>9.2f} "
+              f"{feedparser_time * 1000:>14.2f} {feedparser_time / lxml_time:>7.1f}x")
+    print(f"{'total':<30} {'':>9} {'':>8} {total_lxml * 1000:>9.2f} {total_feedparser * 1000:>14.2f} "
+          f"{total_feedparser / total_lxml:>7.1f}x")
+    print(f"lxml fallbacks to feedparser: {FeedParser.stats['fallbacks']}")
+
+
+if __name__ == '__main__':
+    main()
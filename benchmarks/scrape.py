@@ -0,0 +1,157 @@
+"""
+Measure the scraping of N channels served by the local fake website (benchmarks/fake_site.py), without network. The run
+is the same as `python main.py`: the channels go through the pipeline, `--cycles` times (the next cycles publish
+`--new-items` new items in every feed, the other items are not modified or already saved).
+The result is written in a JSON file to compare the commits:
+
+    python -m benchmarks.scrape --channels 50 --items 30 --cycles 2
+    python -m benchmarks.scrape --ratio-5xx 0.1 --ratio-slow 0.1 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+from benchmarks.fake_site import FakeSite
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPOSITORY, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+async def run(site: FakeSite, args) -> dict:
+    # the program modules are imported in the working directory of the benchmark (logs, files, database, images)
+    import logging
+    import main
+    from src.database_manager import ManageDB
+    from src.fetcher import Fetcher
+    from src.models import News
+    import sqlalchemy as sa
+
+    logging.getLogger().setLevel(args.log_level)
+    Fetcher.max_per_host = args.per_host
+    main.channels.clear()
+    for channel in range(site.channels):
+        main.channels[f"channel-{channel}"] = {
+            'base_url': site.url,
+            'rss_url': f"{site.url}feed/{channel}.xml",
+            'language': 'english',
+            'parser': args.parser,
+        }
+    workers = {stage: getattr(args, f"{stage}_workers") for stage in ('fetch', 'media', 'images')
+               if getattr(args, f"{stage}_workers")}
+
+    async def count_news():
+        return await ManageDB.read(lambda session: session.scalar(sa.select(sa.func.count()).select_from(News)))
+
+    cycles = []
+    started = time.perf_counter()
+    await main.startup(args.clean_workers)
+    try:
+        for cycle in range(args.cycles):
+            site.cycle = cycle
+            rows_before = await count_news()
+            requests_before = dict(site.requests)
+            cycle_started = time.perf_counter()
+            main.Pipeline.workers = {**main.Pipeline.workers, **workers}
+            pipeline = await main.run_once()
+            seconds = time.perf_counter() - cycle_started
+            rows = await count_news() - rows_before
+            save_seconds = pipeline.stats['save']['seconds']
+            cycles.append({
+                'cycle': cycle,
+                'seconds': round(seconds, 3),
+                'news_saved': rows,
+                'items_per_second': round(rows / seconds, 1) if seconds else None,
+                'db_rows_per_second': round(rows / save_seconds, 1) if save_seconds else None,
+                'stages': {stage: {'jobs': stats['jobs'], 'seconds': round(stats['seconds'], 3)}
+                           for stage, stats in pipeline.stats.items()},
+                'requests': {key: count - requests_before.get(key, 0) for key, count in site.requests.items()
+                             if count != requests_before.get(key, 0)},
+            })
+            print(f"cycle {cycle}: {rows} news saved in {seconds:.2f}s", file=sys.stderr)
+    finally:
+        await main.shutdown()
+    from src.scraper import Scraper
+    from src.feed_parser import FeedParser
+    from src.media_cache import MediaCache
+    return {
+        'seconds': round(time.perf_counter() - started, 3),
+        'news_saved': sum(cycle['news_saved'] for cycle in cycles),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'cycles': cycles,
+        'media': dict(Scraper.media_stats),
+        'media_cache': dict(MediaCache.stats),
+        'parsers': dict(FeedParser.stats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the scraping against a local fake news website")
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--items', type=int, default=30, help="number of items of every feed")
+    parser.add_argument('--new-items', type=int, default=5, help="new items published by every feed in every cycle")
+    parser.add_argument('--cycles', type=int, default=2)
+    parser.add_argument('--thumbnails', type=float, default=0.5, help="ratio of the items with image in the feed")
+    parser.add_argument('--article-size', type=int, default=100 * 1024, help="size of the articles in bytes")
+    parser.add_argument('--ratio-403', type=float, default=0.0, help="ratio of the channels answering 403")
+    parser.add_argument('--ratio-404', type=float, default=0.0)
+    parser.add_argument('--ratio-5xx', type=float, default=0.0)
+    parser.add_argument('--ratio-slow', type=float, default=0.0)
+    parser.add_argument('--slow-delay', type=float, default=0.5, help="delay of the slow channels in seconds")
+    parser.add_argument('--parser', default='lxml', choices=('lxml', 'feedparser'))
+    parser.add_argument('--per-host', type=int, default=50, help="requests in the same time to the website (one host)")
+    parser.add_argument('--fetch-workers', type=int, default=0)
+    parser.add_argument('--media-workers', type=int, default=0)
+    parser.add_argument('--images-workers', type=int, default=0)
+    parser.add_argument('--clean-workers', type=int, default=0, help="processes used to clean the feeds")
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help="JSON file of the result, default benchmarks/results/<time>-<commit>.json")
+    args = parser.parse_args()
+
+    ratios = {'403': args.ratio_403, '404': args.ratio_404, '5xx': args.ratio_5xx, 'slow': args.ratio_slow}
+    site = FakeSite(args.channels, args.items, args.new_items, args.thumbnails, article_size=args.article_size,
+                    slow_delay=args.slow_delay, ratios=ratios).start()
+    commit = git_commit()
+    output = os.path.abspath(args.output or os.path.join(
+        REPOSITORY, 'benchmarks', 'results', f"{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'unknown'}.json"))
+    working_directory = tempfile.mkdtemp(prefix='scrape-benchmark-')
+    os.makedirs(os.path.join(working_directory, 'logs'))
+    os.chdir(working_directory)
+    try:
+        result = asyncio.run(run(site, args))
+    finally:
+        site.stop()
+    result = {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'settings': {key: value for key, value in vars(args).items() if key != 'output'},
+        'working_directory': working_directory,
+        **result,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(result, file, indent=2)
+    print(json.dumps({key: result[key] for key in ('seconds', 'news_saved', 'peak_rss_mb')}))
+    print(f"Result saved in {output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
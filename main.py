@@ -1,57 +1,188 @@
+import argparse
 import asyncio
 import logging
+import os
+import socket
+import sys
 import time
 
-from src.scraper import Scraper
-from src.handle_errors import ErrorHandler
 from src.database_manager import ManageDB
 from src.cleaner import Cleaner
 from src.buffering import Buffering
+from src.fetcher import Fetcher
+from src.browser_pool import BrowserPool
+from src.retry import Retry
+from src.scheduler import Scheduler
+from src.retry_queue import RetryQueue
+from src.channel_registry import ChannelRegistry
+from src.pipeline import Pipeline
+from src.media_cache import MediaCache
+from src.cassette import Cassette
+from src.metrics import Metrics
+from src.work_queue import WorkQueue
+from src.handle_errors import ErrorHandler
 
 # channels dictionary hold channels tou want to scrape with its base url , rss feed and language used
+# `parser` is optional: 'lxml' (default) the fast parser, or 'feedparser' for the feeds that lxml parse badly
 channels = {
     "example": {
         "base_url": "https://www.example.com/",
         "rss_url": "http://www.example.com/feed",
         "language": "english",
+        "parser": "lxml",
     },
 }
 
 
-async def find_channel_name(channel_url: str):
-    for key, value in channels.items():
-        if channel_url == value['base_url']:
-            return key
-    return ""
-
-
-async def manager(data: dict):
-    global channels
-    channels['delay'] = time.time() + 120
-    data_content = data['data']
-    channel_name = await find_channel_name(data_content['channel_url'])
-    logging.info(f"Find channel {channel_name} with url {data_content['channel_url']}")
-    # clean news data
-    data['data']['news'] = await Cleaner.handel_news_garbage(data_content)
-    for news in data['data']['news']:
-        if news.get("media") == 'Nothings':
-            logging.info(f"Image for {news.get('link')} not saved")
-        else:
-            news['media_path'] = await Scraper.save_image(news.get("media"), channel_name)
-            logging.info(f"Image {news['media_path']} is saved successfully")
-    # Update channel news number
-    await ManageDB.update_number_of_news(channel_name, data_content['number_of_news'])
-    # save news to database
-    await ManageDB.save_news(data, channel_name)
+async def poll_done(name: str, data: dict = None):
+    # Schedule the next poll of the channel from the result of its poll
+    try:
+        Scheduler.update(name, data)
+    except Exception as e:
+        logging.error(f"Exception when updating the interval of {name}: {e}", exc_info=True)
+    finally:
+        Scheduler.schedule(name)
+
+
+async def run_once():
+    # Every channel is scraped one time, the channels go through the pipeline in the same time
+    pipeline = Pipeline(channels)
+    pipeline.start()
+    try:
+        for name in channels:
+            await pipeline.submit(name)
+        logging.info("All channels submitted to the pipeline")
+    finally:
+        await pipeline.close()
+    return pipeline
+
+
+async def run_daemon():
+    # Poll every channel when its time is reached, until the program is stopped
+    # the channels in the pipeline, a channel is not submitted again before its poll is finished
+    in_flight: set[str] = set()
 
+    async def done(name: str, data: dict = None):
+        in_flight.discard(name)
+        await poll_done(name, data)
+
+    pipeline = Pipeline(channels, on_done=done)
+    pipeline.start()
+    budget_reset = time.time()
+    metrics_export = time.time() + Metrics.export_interval
+    for name in channels:
+        Scheduler.schedule(name, time.time())
+    while True:
+        if time.time() >= budget_reset:
+            Retry.reset_budget()
+            budget_reset = time.time() + 3600
+        if Metrics.enabled and time.time() >= metrics_export:
+            Metrics.export()
+            metrics_export = time.time() + Metrics.export_interval
+        # the feeds failed are polled when their retry time is reached
+        for item in RetryQueue.pop_due():
+            channel = ChannelRegistry.find_by_rss_url(item['url'])
+            if channel and channel.name in in_flight:
+                # the poll running is the retry, if it fails the feed is pushed again in the retry queue
+                continue
+            if channel and channel.name in channels:
+                Scheduler.schedule(channel.name, time.time())
+            else:
+                RetryQueue.done(item['url'])
+        for name in Scheduler.pop_due():
+            # scheduled again when its poll is finished
+            if name in in_flight:
+                continue
+            in_flight.add(name)
+            await pipeline.submit(name)
+        await ChannelRegistry.flush()
+        await Scheduler.wait_next(RetryQueue.next_due())
+
+
+async def run_coordinator(work_queue):
+    # Push the channels due to the work queue, the workers scrape them, their results schedule the next polls
+    # the feeds not reached by the workers are in the retry queue of the coordinator
+    for name in channels:
+        Scheduler.schedule(name, time.time())
+    while True:
+        for name, result in await work_queue.results():
+            if name not in channels:
+                continue
+            failure = (result or {}).get('failure')
+            if failure:
+                await ErrorHandler.not_handled_websites({'data': {'work_on': channels[name]['rss_url'], **failure}})
+                result = None
+            else:
+                RetryQueue.done(channels[name]['rss_url'])
+            await poll_done(name, result)
+        for item in RetryQueue.pop_due():
+            channel = ChannelRegistry.find_by_rss_url(item['url'])
+            if channel and channel.name in channels:
+                Scheduler.schedule(channel.name, time.time())
+            else:
+                RetryQueue.done(item['url'])
+        due = Scheduler.pop_due()
+        if due:
+            pushed = await work_queue.push(due)
+            logging.info(f"{pushed} channels pushed to the work queue, {await work_queue.size()}")
+        # the results are read every second
+        await Scheduler.wait_next(time.time() + 1)
 
-async def create_scrapers():
-    # scrapers list contains coroutines to scrape every channel
-    scrapers = []
-    for item in channels.values():
-        scrapers.append(Scraper.get_news((item['base_url'], item['rss_url'])))
-    logging.info("Created Scrapers successfully")
-    return await asyncio.gather(*scrapers)
+
+async def run_worker(work_queue, max_channels: int = 32):
+    # Lease the channels of the work queue and scrape them, `max_channels` channels in the pipeline in the same time
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    leased: set[str] = set()
+    free = asyncio.Semaphore(max_channels)
+    # {rss url: the error of the feed not reached}, sent to the coordinator with the result of the channel
+    failures: dict[str, dict] = {}
+
+    async def failed(result: dict):
+        failures[result['data']['work_on']] = {'error': result['data']['error'], 'date': result['data']['date']}
+
+    async def done(name: str, data: dict = None):
+        # only the result used by the Scheduler of the coordinator
+        failure = failures.pop(channels[name]['rss_url'], None)
+        result = {'number_of_news': data.get('number_of_news', 0), 'poll_hints': data.get('poll_hints', {})} \
+            if data else {'failure': failure} if failure else None
+        try:
+            if not await work_queue.ack(name, worker, result):
+                logging.error(f"Lease of {name} lost, the channel was given to another worker")
+        finally:
+            leased.discard(name)
+            free.release()
+
+    async def heartbeat():
+        # the channels still in the pipeline keep their lease, even when all the slots are busy
+        while True:
+            await asyncio.sleep(work_queue.lease_timeout / 3)
+            for name in list(leased):
+                try:
+                    if not await work_queue.extend(name, worker):
+                        logging.error(f"Lease of {name} lost, the channel was given to another worker")
+                except Exception as e:
+                    logging.error(f"Exception when extending the lease of {name}: {e}")
+            await ChannelRegistry.flush()
+
+    pipeline = Pipeline(channels, on_done=done, seen_links=work_queue, on_failed=failed)
+    pipeline.start()
+    heartbeat_task = asyncio.create_task(heartbeat())
+    logging.info(f"Worker {worker} started")
+    try:
+        while True:
+            await free.acquire()
+            name = await work_queue.lease(worker)
+            if name is None or name not in channels:
+                if name is not None:
+                    logging.error(f"Channel {name} unknown by the worker {worker}")
+                    await work_queue.ack(name, worker)
+                free.release()
+                await asyncio.sleep(1)
+                continue
+            leased.add(name)
+            await pipeline.submit(name)
+    finally:
+        heartbeat_task.cancel()
 
 
 async def insert_channels():
@@ -66,35 +197,85 @@ async def insert_channels():
                 'language': channel['language']
             }
         )
-    await ManageDB.add_channels(channels_info)
+    await ChannelRegistry.register(channels_info)
 
 
-async def main():
+async def startup(clean_workers: int = 0):
+    # Open the database, the buffers and the client used by all the channels
+    if clean_workers:
+        Cleaner.use_process_pool(clean_workers)
     await ManageDB.create_tables()
+    await ManageDB.load_link_index()
     await Buffering.open_buffers()
+    RetryQueue.load(Buffering.not_handled_urls_buffer)
+    MediaCache.load(Buffering.media_cache_buffer)
     await insert_channels()
-    try:
-        result = await create_scrapers()
+    await Fetcher.open_client()
+    Retry.reset_budget()
 
-        # Check data status
-        for data in result:
-            if data['status']:
-                await manager(data)
-            else:
-                error = data['data']['error']
-                if error == 403:
-                    content = await ErrorHandler.handle_403(data['data']['work_on'])
-                    if content:
-                        await Scraper.get_rss_data(content, (data['data']['channel_url'], data['data']['work_on']))
-                    else:
-                        await ErrorHandler.not_handled_websites(data)
-                elif error == 404:
-                    await ErrorHandler.not_handled_websites(data)
-                else:
-                    await ErrorHandler.not_handled_websites(data)
+
+async def shutdown():
+    await Fetcher.close_client()
+    await BrowserPool.close()
+    Cleaner.close_process_pool()
+    await ChannelRegistry.flush()
+    await ManageDB.close()
+    await Buffering.close_buffers()
+    Cassette.close()
+    if Metrics.enabled:
+        Metrics.export()
+        print(Metrics.summary(), file=sys.stderr)
+
+
+async def main(daemon: bool = False, clean_workers: int = 0, coordinator: bool = False, worker: bool = False,
+               redis_url: str = None):
+    await startup(clean_workers)
+    work_queue = WorkQueue.connect(redis_url) if coordinator or worker else None
+    try:
+        if coordinator or worker:
+            # both in the same process with the stand-in queue ('memory://')
+            await asyncio.gather(*([run_coordinator(work_queue)] if coordinator else []),
+                                 *([run_worker(work_queue)] if worker else []))
+        elif daemon:
+            await run_daemon()
+        else:
+            await run_once()
     except Exception as e:
         logging.error(f"Exception: {e}", exc_info=True)
     finally:
-        await Buffering.close_buffers()
+        if work_queue is not None:
+            await work_queue.close()
+        await shutdown()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Scrape recent news from the channels")
+    parser.add_argument('--daemon', action='store_true', help="keep running and poll every channel on its own interval")
+    parser.add_argument('--clean-workers', type=int, default=0,
+                        help="number of processes used to clean the big feeds, 0 to clean in the main process")
+    parser.add_argument('--record', metavar='CASSETTE', help="record all the responses of the run in the cassette file")
+    parser.add_argument('--replay', metavar='CASSETTE', help="answer the requests by the responses of the cassette file, "
+                                                             "without network")
+    parser.add_argument('--replay-latency', action='store_true',
+                        help="with --replay, wait the recorded latency of every response instead of full speed")
+    parser.add_argument('--metrics', metavar='FILE', nargs='?', const='',
+                        help="collect the metrics of the run, print their summary at the end and write them in the "
+                             "Prometheus FILE if given")
+    parser.add_argument('--coordinator', action='store_true',
+                        help="push the channels due to the work queue, scraped by the workers")
+    parser.add_argument('--worker', action='store_true',
+                        help="scrape the channels of the work queue, many workers can run on many machines")
+    parser.add_argument('--redis-url', default=os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+                        help="Redis of the work queue, 'memory://' to run the coordinator and a worker in one process")
+    args = parser.parse_args()
+    if args.metrics is not None:
+        Metrics.enable(args.metrics or None)
+    if args.record:
+        Cassette.record(args.record)
+    elif args.replay:
+        Cassette.replay(args.replay, latency=args.replay_latency)
+    try:
+        asyncio.run(main(daemon=args.daemon, clean_workers=args.clean_workers, coordinator=args.coordinator,
+                         worker=args.worker, redis_url=args.redis_url))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,125 @@
+import asyncio
+from contextlib import asynccontextmanager
+from playwright import async_api
+import logging
+import src.logging_config
+
+logger = logging.getLogger("BrowserPool")
+
+
+class BrowserPool:
+    """
+    One headless browser started the first time it is needed and used until the end of the program. The pages are opened
+    in a fixed number of contexts, every context used by `pages_per_context` pages in the same time.
+    """
+    chrome_path = "path/to/chrome.exe"
+    number_of_contexts = 2
+    pages_per_context = 2
+    # a context is closed and replaced after this number of pages, to free the memory used by the browser
+    context_max_uses = 50
+    # timeout budget of loading a page in milliseconds
+    page_timeout = 30000
+    blocked_resources = {'image', 'font', 'media'}
+    playwright: async_api.Playwright = None
+    browser: async_api.Browser = None
+    slots: asyncio.Queue = None
+    uses: dict = {}
+    lock: asyncio.Lock = None
+
+    @staticmethod
+    async def start():
+        """Start the browser and create the contexts, if it is already started nothing change"""
+        if BrowserPool.lock is None:
+            BrowserPool.lock = asyncio.Lock()
+        async with BrowserPool.lock:
+            if BrowserPool.browser is not None:
+                return
+            playwright = await async_api.async_playwright().start()
+            try:
+                BrowserPool.browser = await playwright.chromium.launch(
+                    executable_path=BrowserPool.chrome_path,
+                    headless=True,
+                )
+            except async_api.Error:
+                await playwright.stop()
+                raise
+            BrowserPool.playwright = playwright
+            BrowserPool.slots = asyncio.Queue()
+            BrowserPool.uses = {}
+            for _ in range(BrowserPool.number_of_contexts):
+                context = await BrowserPool.__new_context()
+                for _ in range(BrowserPool.pages_per_context):
+                    BrowserPool.slots.put_nowait(context)
+            logger.info(f"Browser started with {BrowserPool.number_of_contexts} contexts")
+
+    @staticmethod
+    async def __new_context():
+        context = await BrowserPool.browser.new_context()
+        context.set_default_timeout(BrowserPool.page_timeout)
+        BrowserPool.uses[context] = 0
+        return context
+
+    @staticmethod
+    async def __renew_context(context):
+        """Replace a context used `context_max_uses` times, when all its pages are back to the pool"""
+        slots = [BrowserPool.slots.get_nowait() for _ in range(BrowserPool.slots.qsize())]
+        others = [slot for slot in slots if slot is not context]
+        if len(slots) - len(others) < BrowserPool.pages_per_context - 1:
+            # a page of this context still open, renew it later
+            for slot in slots:
+                BrowserPool.slots.put_nowait(slot)
+            return context
+        BrowserPool.uses.pop(context, None)
+        await context.close()
+        new_context = await BrowserPool.__new_context()
+        for slot in others:
+            BrowserPool.slots.put_nowait(slot)
+        for _ in range(BrowserPool.pages_per_context - 1):
+            BrowserPool.slots.put_nowait(new_context)
+        logger.info("Browser context renewed")
+        return new_context
+
+    @staticmethod
+    async def __block_resources(route: async_api.Route):
+        if route.request.resource_type in BrowserPool.blocked_resources:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    @staticmethod
+    @asynccontextmanager
+    async def page(block_resources: bool = False):
+        """
+        Open a page in a free context of the pool, used with `async with`
+        :param block_resources: if True the images, fonts and media are not loaded (used to get the cookies)
+        :return: tuple of the context and the page
+        """
+        await BrowserPool.start()
+        context = await BrowserPool.slots.get()
+        page = None
+        try:
+            page = await context.new_page()
+            if block_resources:
+                await page.route("**/*", BrowserPool.__block_resources)
+            yield context, page
+        finally:
+            if page is not None:
+                await page.close()
+            BrowserPool.uses[context] = BrowserPool.uses.get(context, 0) + 1
+            if BrowserPool.uses[context] >= BrowserPool.context_max_uses:
+                context = await BrowserPool.__renew_context(context)
+            BrowserPool.slots.put_nowait(context)
+
+    @staticmethod
+    async def close():
+        """Close the contexts and the browser"""
+        if BrowserPool.browser is None:
+            return
+        for context in list(BrowserPool.uses):
+            await context.close()
+        await BrowserPool.browser.close()
+        await BrowserPool.playwright.stop()
+        BrowserPool.browser = None
+        BrowserPool.playwright = None
+        BrowserPool.uses = {}
+        logger.info("Browser closed")
@@ -1,6 +1,9 @@
+import asyncio
 import json
 import csv
+import time
 from enum import Enum
+from typing import Callable, Iterator
 import logging
 import os
 import src.logging_config
@@ -103,18 +106,263 @@ class CSVBuffer:
             logger.info(f"Buffer<{self.file_path}> is closed")
 
 
+class JournalBuffer:
+    """
+    Append-only JSON Lines file, every item is a line. The items are not held in memory, they are written to the file
+    by groups (group commit) every `commit_items` items or `commit_interval` seconds, so if the program crash only the
+    last group is lost. The interval is a timer of the event loop, the items are written even if no other item is added;
+    without event loop running every item is written directly. The file is compacted every `compact_every` items, and
+    when the buffer is closed.
+    """
+    def __init__(self, file_path: str, key: str = None, keep: Callable[[dict], bool] = None, commit_items: int = 20,
+                 commit_interval: float = 1.0, fsync_interval: float = 5.0, compact_every: int = 10000):
+        """
+        :param file_path: path of the .jsonl file
+        :param key: when compacted, only the last item of every value of this key is kept
+        :param keep: when compacted, only the items that `keep(item)` is True are kept
+        :param commit_items: number of items written to the file in the same time
+        :param commit_interval: maximum seconds an item wait before it is written to the file
+        :param fsync_interval: seconds between two fsync, 0 to fsync every commit, None to never fsync
+        :param compact_every: number of items added between two compaction, None to compact only when closed
+        """
+        self.file_path = file_path
+        self.key = key
+        self.keep = keep
+        self.commit_items = commit_items
+        self.commit_interval = commit_interval
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.pending = []
+        self.added_since_compaction = 0
+        self.last_commit = self.last_fsync = time.monotonic()
+        # the commit waiting the end of `commit_interval`
+        self.timer: asyncio.TimerHandle = None
+        self.file = None
+        self.is_open = True
+        self.__open_file()
+
+    def __open_file(self):
+        self.file = open(self.file_path, 'a+', encoding='utf-8')
+        # a crash can leave the last line not complete, start the new items in a new line
+        if self.file.tell() > 0:
+            self.file.seek(self.file.tell() - 1)
+            if self.file.read(1) != '\n':
+                self.file.write('\n')
+
+    def add_item(self, item):
+        """Add item to the journal"""
+        if not self.is_open:
+            raise Exception(f"Buffer is close, no item added")
+        self.pending.append(json.dumps(item, ensure_ascii=False))
+        self.added_since_compaction += 1
+        if len(self.pending) >= self.commit_items or time.monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+        elif self.timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # nothing would write the item later
+                self.commit()
+            else:
+                self.timer = loop.call_later(self.commit_interval, self.__commit_timer)
+        if self.compact_every and self.added_since_compaction >= self.compact_every:
+            self.compact()
+
+    def add_items(self, items: list):
+        for item in items:
+            self.add_item(item)
+
+    def __commit_timer(self):
+        self.timer = None
+        if self.is_open:
+            self.commit()
+
+    def commit(self):
+        """Write the items waiting to the file"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.pending:
+            self.file.write('\n'.join(self.pending) + '\n')
+            self.pending = []
+        self.file.flush()
+        now = time.monotonic()
+        if self.fsync_interval is not None and now - self.last_fsync >= self.fsync_interval:
+            os.fsync(self.file.fileno())
+            self.last_fsync = now
+        self.last_commit = now
+
+    def iter_items(self) -> Iterator:
+        """Iterate the items of the journal one by one, without loading the file"""
+        if self.is_open:
+            self.commit()
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.error(f"Line not complete in <{self.file_path}> ignored")
+        except FileNotFoundError:
+            return
+
+    def get_buffer(self):
+        """:return: list of all the items, load all the file, prefer `iter_items`"""
+        return list(self.iter_items())
+
+    def compact(self):
+        """Rewrite the journal with only the items kept, the file is replaced in one operation"""
+        if not self.key and not self.keep:
+            self.added_since_compaction = 0
+            return
+        if self.key:
+            items = {}
+            for item in self.iter_items():
+                items.pop(item.get(self.key), None)
+                items[item.get(self.key)] = item
+            items = items.values()
+        else:
+            items = self.iter_items()
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            for item in items:
+                if self.keep is None or self.keep(item):
+                    file.write(json.dumps(item, ensure_ascii=False) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self.file.close()
+        os.replace(temp_path, self.file_path)
+        self.__open_file()
+        self.added_since_compaction = 0
+        logger.info(f"Journal<{self.file_path}> compacted")
+
+    def import_json(self, json_path: str):
+        """Add the items of an old JSON file to the journal, the old file renamed to `.old`"""
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, 'r', encoding='utf-8') as file:
+                items = json.load(file)
+        except json.JSONDecodeError:
+            items = []
+        for item in items if isinstance(items, list) else []:
+            self.pending.append(json.dumps(item, ensure_ascii=False))
+        self.commit()
+        os.replace(json_path, json_path + '.old')
+        logger.info(f"{json_path} imported to the journal <{self.file_path}>")
+
+    def close(self):
+        if self.is_open:
+            self.commit()
+            if self.added_since_compaction:
+                self.compact()
+            self.file.close()
+            self.is_open = False
+        else:
+            logger.info(f"Buffer<{self.file_path}> is closed")
+
+    def is_close(self):
+        return not self.is_open
+
+
+class KeyValueJournal(JournalBuffer):
+    """
+    Journal of items saved under a key, used when the program need to find an item directly. The last value of every
+    key is held in memory, every change is appended to the journal like the other journals, so a crash lose only the
+    last group. Line: {'key': key, 'value': value}
+    """
+    def __init__(self, file_path: str, **kwargs):
+        super().__init__(file_path, key='key', **kwargs)
+        self.values = {}
+        for item in self.iter_items():
+            if 'key' in item:
+                self.values[item['key']] = item.get('value')
+
+    def get_item(self, key: str, default=None):
+        return self.values.get(key, default)
+
+    def set_item(self, key: str, value):
+        """Add or replace the item saved under the key"""
+        if not self.is_open:
+            raise Exception(f"Buffer is close, no item added")
+        self.values[key] = value
+        self.add_item({'key': key, 'value': value})
+
+    def get_buffer(self):
+        return self.values
+
+
 class Buffering:
 
     class Files(Enum):
-        NOT_CLEANED_NEWS = "files/news_not_cleaned.json"
+        NOT_CLEANED_NEWS = "files/news_not_cleaned.jsonl"
         USER_AGENT = "files/user_agents.json"
-        COOKIES = "files/cookies.json"
-        NOT_HANDLED_URLS = 'files/not_handled_urls.csv'
+        COOKIES = "files/cookies.jsonl"
+        NOT_HANDLED_URLS = 'files/not_handled_urls.jsonl'
+        FEED_VALIDATORS = 'files/feed_validators.jsonl'
+        MEDIA_CACHE = 'files/media_cache.jsonl'
+        FEED_PROFILES = 'files/feed_profiles.jsonl'
     # Buffers
-    not_cleaned_news_buffer: JSONBuffer = None
+    not_cleaned_news_buffer: JournalBuffer = None
     user_agent_buffer: JSONBuffer = None
-    cookies_buffer: JSONBuffer = None
-    not_handled_urls_buffer: CSVBuffer = None
+    cookies_buffer: JournalBuffer = None
+    not_handled_urls_buffer: JournalBuffer = None
+    feed_validators_buffer: KeyValueJournal = None
+    media_cache_buffer: JournalBuffer = None
+    feed_profiles_buffer: KeyValueJournal = None
+
+    @staticmethod
+    def open_not_cleaned_news_buffer() -> JournalBuffer:
+        buffer = JournalBuffer(Buffering.Files.NOT_CLEANED_NEWS.value)
+        # the file used before the journal
+        buffer.import_json("files/news_not_cleaned.json")
+        return buffer
+
+    @staticmethod
+    def open_cookies_buffer() -> JournalBuffer:
+        # compaction keep the last cookies of every website, if not expired
+        buffer = JournalBuffer(Buffering.Files.COOKIES.value, key='url',
+                               keep=lambda item: item.get('expires', 0) > time.time(), compact_every=1000)
+        buffer.import_json("files/cookies.json")
+        return buffer
+
+    @staticmethod
+    def open_not_handled_urls_buffer() -> JournalBuffer:
+        # compaction keep the last state of every URL, if not handled
+        buffer = JournalBuffer(Buffering.Files.NOT_HANDLED_URLS.value, key='url', keep=lambda item: not item.get('done'))
+        # the file used before the journal
+        old_file = 'files/not_handled_urls.csv'
+        if os.path.exists(old_file):
+            headers = ['URL', 'Status code', 'Time of fail', 'Time of resent']
+            for row in CSVBuffer(old_file, headers).get_buffer():
+                buffer.add_item({
+                    'url': row['URL'],
+                    'error': int(row['Status code'] or 0),
+                    'time_of_fail': float(row['Time of fail']),
+                    'due': float(row['Time of resent']),
+                    'failures': 1,
+                })
+            buffer.commit()
+            os.replace(old_file, old_file + '.old')
+            logger.info(f"{old_file} imported to the journal <{buffer.file_path}>")
+        return buffer
+
+    @staticmethod
+    def open_media_cache_buffer() -> JournalBuffer:
+        # compaction keep the last image of every article, if not expired
+        return JournalBuffer(Buffering.Files.MEDIA_CACHE.value, key='link',
+                             keep=lambda item: item.get('expires', 0) > time.time(), compact_every=5000)
+
+    @staticmethod
+    def open_feed_validators_buffer() -> KeyValueJournal:
+        return KeyValueJournal(Buffering.Files.FEED_VALIDATORS.value)
+
+    @staticmethod
+    def open_feed_profiles_buffer() -> KeyValueJournal:
+        return KeyValueJournal(Buffering.Files.FEED_PROFILES.value)
 
     @staticmethod
     async def open_buffers():
@@ -122,14 +370,20 @@ class Buffering:
             os.makedirs('files')
         try:
             logger.info("Opening Buffers")
-            Buffering.not_cleaned_news_buffer = JSONBuffer(Buffering.Files.NOT_CLEANED_NEWS.value)
+            Buffering.not_cleaned_news_buffer = Buffering.open_not_cleaned_news_buffer()
             logger.info("`not_cleaned_news_buffer` is opened")
-            Buffering.cookies_buffer = JSONBuffer(Buffering.Files.COOKIES.value)
+            Buffering.cookies_buffer = Buffering.open_cookies_buffer()
             logger.info("`cookies_buffer` is opened")
             Buffering.user_agent_buffer = JSONBuffer(Buffering.Files.USER_AGENT.value)
             logger.info("`user_agent_buffer` is opened")
-            headers = ['URL', 'Status code', 'Time of fail', 'Time of resent']
-            Buffering.not_handled_urls_buffer = CSVBuffer(Buffering.Files.NOT_HANDLED_URLS.value, headers)
+            Buffering.not_handled_urls_buffer = Buffering.open_not_handled_urls_buffer()
+            logger.info("`not_handled_urls_buffer` is opened")
+            Buffering.feed_validators_buffer = Buffering.open_feed_validators_buffer()
+            logger.info("`feed_validators_buffer` is opened")
+            Buffering.media_cache_buffer = Buffering.open_media_cache_buffer()
+            logger.info("`media_cache_buffer` is opened")
+            Buffering.feed_profiles_buffer = Buffering.open_feed_profiles_buffer()
+            logger.info("`feed_profiles_buffer` is opened")
         except Exception as e:
             logger.error(f"Exception: {e}", exc_info=True)
             if Buffering.not_cleaned_news_buffer:
@@ -140,6 +394,12 @@ class Buffering:
                 Buffering.user_agent_buffer.close()
             if Buffering.not_handled_urls_buffer:
                 Buffering.not_handled_urls_buffer.close()
+            if Buffering.feed_validators_buffer:
+                Buffering.feed_validators_buffer.close()
+            if Buffering.media_cache_buffer:
+                Buffering.media_cache_buffer.close()
+            if Buffering.feed_profiles_buffer:
+                Buffering.feed_profiles_buffer.close()
             logger.debug("All Buffers are close")
 
     @staticmethod
@@ -152,4 +412,10 @@ class Buffering:
             Buffering.user_agent_buffer.close()
         if Buffering.not_handled_urls_buffer.is_open:
             Buffering.not_handled_urls_buffer.close()
+        if Buffering.feed_validators_buffer.is_open:
+            Buffering.feed_validators_buffer.close()
+        if Buffering.media_cache_buffer.is_open:
+            Buffering.media_cache_buffer.close()
+        if Buffering.feed_profiles_buffer.is_open:
+            Buffering.feed_profiles_buffer.close()
         logger.debug("All Buffers are close")
@@ -0,0 +1,170 @@
+import asyncio
+import gzip
+import json
+import time
+from hashlib import sha256
+import httpx
+import logging
+import src.logging_config
+
+logger = logging.getLogger("Cassette")
+
+
+class RecordTransport(httpx.AsyncBaseTransport):
+    """Transport of the shared client that send the requests and write every response in the cassette"""
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        try:
+            # the body is saved as sent by the server (compressed), the client decode it
+            body = b''.join([chunk async for chunk in response.aiter_raw()])
+        finally:
+            await response.aclose()
+        Cassette.write_record({
+            'kind': 'http',
+            'method': request.method,
+            'url': str(request.url),
+            'status': response.status_code,
+            'headers': [[name, value] for name, value in response.headers.multi_items()],
+            'latency': round(time.perf_counter() - started, 4),
+        }, body)
+        return httpx.Response(response.status_code, headers=response.headers, stream=httpx.ByteStream(body),
+                              extensions=response.extensions)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Transport of the shared client that answer with the responses of the cassette, without network"""
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        record, body = Cassette.next_record('http', str(request.url), request.method)
+        if record is None:
+            raise httpx.ConnectError(f"<{request.method} {request.url}> not in the cassette", request=request)
+        if Cassette.latency:
+            await asyncio.sleep(record['latency'])
+        return httpx.Response(record['status'], headers=record['headers'], stream=httpx.ByteStream(body),
+                              extensions={'http_version': b'HTTP/1.1'})
+
+
+class Cassette:
+    """
+    Record all the responses of a run (the requests of the shared client and the pages loaded by the browser) in one
+    file, and replay them in another run without network, at full speed or with the latency recorded.
+    The file is compressed by gzip, every response is a JSON line followed by its body, and the same body (an image used
+    by many news) is saved one time:
+        {"blob": sha256, "size": n}\\n<n bytes>\\n
+        {"kind": "http", "method": "GET", "url": ..., "status": 200, "headers": [...], "latency": s, "body": sha256}\\n
+    The browser records have the kind 'browser' (content of a page) or 'cookies' (cookies of a website).
+    """
+    mode: str = None
+    latency = False
+    file = None
+    blobs: set[str] = set()
+    # replay: {(kind, method, url): [(record, body), ...]}, the responses of the same request are given in order
+    records: dict[tuple, list] = {}
+    stats = {'recorded': 0, 'replayed': 0, 'missing': 0}
+
+    @staticmethod
+    def record(file_path: str):
+        """Start recording the responses in the file, the file is replaced"""
+        Cassette.mode = 'record'
+        Cassette.blobs = set()
+        Cassette.file = gzip.open(file_path, 'wb', compresslevel=6)
+        Cassette.file.write(json.dumps({'cassette': 1, 'created': time.time()}).encode() + b'\n')
+        logger.info(f"Recording the responses in <{file_path}>")
+
+    @staticmethod
+    def replay(file_path: str, latency: bool = False):
+        """
+        Load the responses of the file, the requests are answered by them
+        :param file_path: the cassette
+        :param latency: if True every response wait its recorded latency, else the run is at full speed
+        """
+        Cassette.mode = 'replay'
+        Cassette.latency = latency
+        Cassette.records = {}
+        blobs = {}
+        number_of_records = 0
+        with gzip.open(file_path, 'rb') as file:
+            file.readline()
+            try:
+                for line in file:
+                    item = json.loads(line)
+                    if 'blob' in item:
+                        blobs[item['blob']] = file.read(item['size'])
+                        file.read(1)
+                        continue
+                    key = (item['kind'], item.get('method', 'GET'), item['url'])
+                    Cassette.records.setdefault(key, []).append((item, blobs.get(item['body'], b'')))
+                    number_of_records += 1
+            except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+                # the recording was stopped before the end of the file
+                logger.error(f"Cassette <{file_path}> truncated, {number_of_records} responses loaded")
+        logger.info(f"Replaying {number_of_records} responses of <{file_path}> (latency={latency})")
+
+    @staticmethod
+    def close():
+        if Cassette.file is not None:
+            Cassette.file.close()
+            Cassette.file = None
+            logger.info(f"Cassette closed, {Cassette.stats['recorded']} responses recorded")
+        elif Cassette.mode == 'replay':
+            logger.info(f"{Cassette.stats['replayed']} responses replayed, {Cassette.stats['missing']} not in the "
+                        f"cassette")
+        Cassette.mode = None
+
+    @staticmethod
+    def transport(transport: httpx.AsyncBaseTransport) -> httpx.AsyncBaseTransport:
+        """:return: the transport of the shared client, depending on the mode of the cassette"""
+        if Cassette.mode == 'record':
+            return RecordTransport(transport)
+        if Cassette.mode == 'replay':
+            return ReplayTransport()
+        return transport
+
+    @staticmethod
+    def write_record(record: dict, body: bytes):
+        if Cassette.file is None:
+            return
+        hash_code = sha256(body).hexdigest()
+        if hash_code not in Cassette.blobs:
+            Cassette.blobs.add(hash_code)
+            Cassette.file.write(json.dumps({'blob': hash_code, 'size': len(body)}).encode() + b'\n' + body + b'\n')
+        Cassette.file.write(json.dumps({**record, 'body': hash_code}).encode() + b'\n')
+        Cassette.stats['recorded'] += 1
+
+    @staticmethod
+    def next_record(kind: str, url: str, method: str = 'GET'):
+        """
+        :return: tuple (record, body) of the next response of the request, the last response is given again when all
+        the responses are given. (None, None) if the request is not in the cassette.
+        """
+        responses = Cassette.records.get((kind, method, url))
+        if not responses:
+            Cassette.stats['missing'] += 1
+            logger.info(f"<{url}> not in the cassette")
+            return None, None
+        Cassette.stats['replayed'] += 1
+        return responses.pop(0) if len(responses) > 1 else responses[0]
+
+    @staticmethod
+    def save_content(kind: str, url: str, content, latency: float = 0):
+        """Record the result of the browser: the content of a page ('browser') or the cookies of a website ('cookies')"""
+        if Cassette.mode != 'record':
+            return
+        body = json.dumps(content).encode() if kind == 'cookies' else content.encode()
+        Cassette.write_record({'kind': kind, 'url': url, 'latency': round(latency, 4)}, body)
+
+    @staticmethod
+    async def get_content(kind: str, url: str):
+        """:return: the result of the browser recorded, None if not recorded"""
+        record, body = Cassette.next_record(kind, url)
+        if record is None:
+            return None
+        if Cassette.latency:
+            await asyncio.sleep(record['latency'])
+        return json.loads(body) if kind == 'cookies' else body.decode()
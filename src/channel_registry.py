@@ -0,0 +1,71 @@
+import logging
+import src.logging_config
+from src.database_manager import ManageDB
+from src.models import Channel
+
+logger = logging.getLogger("ChannelRegistry")
+
+
+class ChannelRegistry:
+    """
+    The channels of the database loaded one time, indexed by name, base URL and RSS URL. The number of news of the
+    channels is counted in memory and saved by `flush` in one statement.
+    """
+    by_name: dict[str, Channel] = {}
+    by_base_url: dict[str, Channel] = {}
+    by_rss_url: dict[str, Channel] = {}
+    news_counts: dict[int, int] = {}
+
+    @staticmethod
+    async def load():
+        """Load all the channels of the database"""
+        channels = await ManageDB.get_channels()
+        ChannelRegistry.by_name = {channel.name: channel for channel in channels}
+        ChannelRegistry.by_base_url = {channel.base_url: channel for channel in channels}
+        ChannelRegistry.by_rss_url = {channel.rss_url: channel for channel in channels}
+        logger.info(f"{len(channels)} channels loaded")
+
+    @staticmethod
+    async def register(channels_info: list[dict]):
+        """
+        Save the channels configured, only the channels new or changed are written to the database
+        :param channels_info: list of dict objects with the keys 'name', 'base_url', 'rss_url' and 'language'
+        """
+        await ChannelRegistry.load()
+        changed = []
+        for channel_info in channels_info:
+            channel = ChannelRegistry.by_name.get(channel_info['name'])
+            if channel is None or any(getattr(channel, key) != value for key, value in channel_info.items()):
+                changed.append(channel_info)
+        if changed:
+            await ManageDB.upsert_channels(changed)
+            await ChannelRegistry.load()
+        logger.info(f"{len(changed)} channels added or updated, {len(channels_info) - len(changed)} not changed")
+
+    @staticmethod
+    def get(name: str):
+        return ChannelRegistry.by_name.get(name)
+
+    @staticmethod
+    def find_by_base_url(base_url: str):
+        return ChannelRegistry.by_base_url.get(base_url)
+
+    @staticmethod
+    def find_by_rss_url(rss_url: str):
+        return ChannelRegistry.by_rss_url.get(rss_url)
+
+    @staticmethod
+    def add_news(channel: Channel, number_of_news: int):
+        """Count news saved for the channel, saved to the database by `flush`"""
+        if number_of_news:
+            ChannelRegistry.news_counts[channel.channel_id] = \
+                ChannelRegistry.news_counts.get(channel.channel_id, 0) + number_of_news
+            channel.number_of_news = (channel.number_of_news or 0) + number_of_news
+
+    @staticmethod
+    async def flush():
+        """Save the number of news counted since the last flush"""
+        counts, ChannelRegistry.news_counts = ChannelRegistry.news_counts, {}
+        if counts:
+            await ManageDB.increment_number_of_news(counts)
+            logger.info(f"Number of news of {len(counts)} channels updated")
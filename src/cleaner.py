@@ -3,12 +3,105 @@ import time
 import re
 import logging
 import json
+import html as html_decoder
+from concurrent.futures import ProcessPoolExecutor
+from lxml import html, etree
 import src.logging_config
-from src.buffering import Buffering, JSONBuffer
+from src.buffering import Buffering
 logger = logging.getLogger("Cleaner")
 
 
+# The rules are compiled one time, every element of the news must match its pattern
+PATTERNS = {
+    'title': re.compile(r"^.+$"),
+    'link': re.compile(r"^(https?://[a-z0-9-]+)(\.[a-z0-9-]+)+(:\d+)?(/[^ ]*)?$"),
+    'publish_date': re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$"),
+    'description': re.compile(r"^.+$"),
+    'media': re.compile(r"^(https?://[a-z0-9-]+)(\.[a-z0-9-]+)+(:\d+)?(/[^ ]*)?$"),
+}
+# The tags that separate the text, a space is added after them so the paragraphs are not joined
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'tr', 'td', 'th',
+              'table', 'section', 'article', 'header', 'footer', 'figure', 'figcaption', 'pre', 'hr'}
+WHITESPACES = re.compile(r"\s+")
+# The elements a news can miss, the other elements empty make the news not clean
+OPTIONAL_ELEMENTS = {'media'}
+
+
+def _eliminate_tags(text: str) -> str:
+    """Eliminate the tags and let the text, lxml used only if the text has tags"""
+    if '<' not in text:
+        return text.strip()
+    try:
+        tree = html.fromstring(text)
+    except (etree.ParserError, ValueError):
+        return text.strip()
+    for element in tree.iter():
+        if element.tag in BLOCK_TAGS:
+            element.tail = ' ' + (element.tail or '')
+    return WHITESPACES.sub(' ', tree.text_content()).strip()
+
+
+def _strip_html(text: str) -> str:
+    """Replace the HTML decoders and eliminate the tags"""
+    return _eliminate_tags(html_decoder.unescape(text))
+
+
+def _clean_news(news: dict) -> dict:
+    """
+    Clean the elements of one news, the same steps of `Cleaner.patter_check` without logs, so it can run in a process
+    :return: dict object with the state of every element `result` and the `news`
+    """
+    clean_result = {}
+    for key, value in news.items():
+        pattern = PATTERNS.get(key)
+        if pattern is None:
+            continue
+        # an element with only tags (like an image in the description) is empty after the cleaning
+        content = _strip_html(value) if value else ''
+        if not content:
+            news[key] = "Nothings"
+            if key not in OPTIONAL_ELEMENTS:
+                clean_result[key] = 'not_clean'
+            continue
+        # the element stored is the cleaned one, so it is the one checked
+        cleaned_element = pattern.match(content)
+        if cleaned_element:
+            news[key] = cleaned_element.group(0)
+            clean_result[key] = 'clean'
+        else:
+            clean_result[key] = 'not_clean'
+    return {
+        'result': clean_result,
+        'news': news,
+    }
+
+
+def _clean_batch(news: list[dict]) -> list[dict]:
+    return [_clean_news(item) for item in news]
+
+
 class Cleaner:
+    # Process pool used to clean the big feeds, None to clean in the event loop thread
+    executor: ProcessPoolExecutor = None
+    # number of news from which the process pool is used, and number of news sent to a process in one time
+    process_pool_threshold = 200
+    process_pool_chunk = 100
+    # counters of the last cleaning of every feed: {rss url: {'clean': n, 'garbage': n, 'cleaned_at': timestamp}}
+    stats: dict[str, dict] = {}
+
+    @staticmethod
+    def use_process_pool(workers: int = None):
+        """Clean the big feeds in a pool of processes, to use all the cores"""
+        if Cleaner.executor is None:
+            Cleaner.executor = ProcessPoolExecutor(max_workers=workers)
+            logger.info(f"Cleaning process pool started with {Cleaner.executor._max_workers} workers")
+
+    @staticmethod
+    def close_process_pool():
+        if Cleaner.executor is not None:
+            Cleaner.executor.shutdown()
+            Cleaner.executor = None
+
     @staticmethod
     async def patter_check(news: dict[str, str]):
         """
@@ -16,43 +109,43 @@ class Cleaner:
         :param news: dict object that contains news informations like: title, description, ect
         :return: dict object contains result that show the state of every element in the news, and news
         """
-        clean_result = dict()
-        patterns = {
-            'title': r"^.+$",
-            'link': r"^(https?://[a-z0-9-]+)(\.[a-z0-9-]+)+(:\d+)?(/[^ ]*)?$",
-            'publish_date': r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$",
-            'description': r"^.+$",
-            'media': r"^(https?://[a-z0-9-]+)(\.[a-z0-9-]+)+(:\d+)?(/[^ ]*)?$",
-        }
-        logger.info(f"Test cleaning of -> {Cleaner.__news_hash(news)}")
-        for key, value in news.items():
-            if not value:
-                news[key] = "Nothings"
-                logger.info(f"{key.capitalize()} is Not clean")
-            else:
-                match = re.match(patterns[key], value)
-                if match:
-                    logger.info(f"{key.capitalize()} is clean")
-                    logger.info("Eliminate html tags and html tags decoder")
-                    news[key] = Cleaner.eliminate_html_tags(Cleaner.eliminate_html_tag_decoder(value))
-                    clean_result[key] = 'clean'
-                else:
-                    logger.info(f"{key.capitalize()} is Not clean")
-                    logger.info("Eliminate html tags and html tags decoder")
-                    content = Cleaner.eliminate_html_tags(Cleaner.eliminate_html_tag_decoder(value))
-                    cleaned_element = re.match(patterns[key], content)
-                    if cleaned_element:
-                        logger.info(f"The {key.capitalize()} is cleaned successfully")
-                        news[key] = cleaned_element.group(0)
-                        clean_result[key] = 'clean'
-                    else:
-                        logger.info(f"The {key.capitalize()} is Not cleaned")
-                        logger.info(f"The {key.capitalize()} is -> {value}")
-                        clean_result[key] = 'not_clean'
-        return {
-            'result': clean_result,
-            'news': news,
-        }
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Test cleaning of -> {Cleaner.__news_hash(news)}")
+        result = _clean_news(news)
+        if logger.isEnabledFor(logging.DEBUG):
+            for key, state in result['result'].items():
+                logger.debug(f"{key.capitalize()} is {'clean' if state == 'clean' else 'Not clean'}")
+        return result
+
+    @staticmethod
+    async def clean_feed(news: list[dict]) -> list[dict]:
+        """
+        Clean all the news of a feed in one call, a big feed is cleaned in the process pool if it is used
+        :param news: list of news
+        :return: list of results of `patter_check`, in the same order
+        """
+        if Cleaner.executor is None or len(news) < Cleaner.process_pool_threshold:
+            return _clean_batch(news)
+        loop = asyncio.get_running_loop()
+        chunks = [news[i:i + Cleaner.process_pool_chunk] for i in range(0, len(news), Cleaner.process_pool_chunk)]
+        results = await asyncio.gather(*[loop.run_in_executor(Cleaner.executor, _clean_batch, chunk) for chunk in chunks])
+        # the news cleaned in the processes are copies
+        cleaned = [result for chunk_results in results for result in chunk_results]
+        for item, result in zip(news, cleaned):
+            item.update(result['news'])
+            result['news'] = item
+        return cleaned
+
+    @staticmethod
+    def clean_media(media: str) -> str:
+        """
+        Clean the URL of an image found after the cleaning of its news
+        :return: the URL cleaned, "Nothings" if no image or the URL not match its pattern
+        """
+        result = _clean_news({'media': media})
+        if result['result'].get('media') == 'clean':
+            return result['news']['media']
+        return "Nothings"
 
     @staticmethod
     def eliminate_html_tags(text: str):
@@ -62,23 +155,48 @@ class Cleaner:
         :param text: string object
         :return: cleaned text
         """
-        from lxml import html
-        element = html.fromstring(text)
-        cleaned_text = element.xpath("//p[1]/text()")
-        return cleaned_text[0]
+        return _eliminate_tags(text)
 
     @staticmethod
-    async def save_no_cleaned_news(garbage: dict):
+    async def save_no_cleaned_news(garbage: list[dict]):
         """
         News that has titles for example not match the patterns, use this function to save them in a file
-        for later cleaning
-        :param garbage: no clean news
+        for later cleaning, all the garbage of a feed is saved in one time
+        :param garbage: list of no clean news
         """
+        if not garbage:
+            return
         if not Buffering.not_cleaned_news_buffer:
-            Buffering.not_cleaned_news_buffer = JSONBuffer(Buffering.Files.NOT_CLEANED_NEWS.value)
-        logger.error(f"Add garbage news: `{Cleaner.__news_hash(garbage['garbage_news'])}`")
-        Buffering.not_cleaned_news_buffer.add_item(garbage)
-        logger.info(f"NOT CLEANED NEWS BUFFER: {Buffering.not_cleaned_news_buffer.get_buffer()}")
+            Buffering.not_cleaned_news_buffer = Buffering.open_not_cleaned_news_buffer()
+        Buffering.not_cleaned_news_buffer.add_items(garbage)
+        logger.error(f"Add {len(garbage)} garbage news from {garbage[0]['work_on']}")
+
+    @staticmethod
+    async def partition_news(data: dict) -> tuple[list[dict], list[dict]]:
+        """
+        Clean the news of a feed and separate them in one pass, the counters of the feed saved in `Cleaner.stats`
+        :param data: dict object has the form of data returned by Scraper
+        :return: tuple of the cleaned news and the garbage records
+        """
+        clean_news = []
+        garbage = []
+        cleaned_at = time.time()
+        for result in await Cleaner.clean_feed(data['news']):
+            if all(state == 'clean' for state in result['result'].values()):
+                clean_news.append(result['news'])
+            else:
+                garbage.append({
+                    'garbage_news': result['news'],
+                    'cleaned_at': cleaned_at,
+                    'channel': data['channel_url'],
+                    'work_on': data['work_on'],
+                    'result': result['result'],
+                    'hash': Cleaner.__news_hash(result['news']),
+                })
+        Cleaner.stats[data['work_on']] = {'clean': len(clean_news), 'garbage': len(garbage), 'cleaned_at': cleaned_at}
+        logger.info(f"{data['work_on']}: {len(clean_news)} news clean, {len(garbage)} garbage news")
+        return clean_news, garbage
+
     @staticmethod
     async def handel_news_garbage(data: dict):
         """
@@ -86,37 +204,13 @@ class Cleaner:
         :param data: dict object has the form of data returned by Scraper
         :return: cleaned news in data
         """
-        def revise_data(news: list, garbage_news: list):
-            e = 0
-            while e < len(news):
-                if news[e] in garbage_news:
-                    news.remove(news[e])
-                else:
-                    e += 1
-            return news
-
-        garbage_tasks = []
-        garbage_news = []
-        for news in data['news']:
-            result = await Cleaner.patter_check(news)
-            if not all(result['result'].values()):
-                garbage = {
-                    'garbage_news': result['news'],
-                    'cleaned_at': time.time(),
-                    'channel': data['data']['channel'],
-                    'hash': Cleaner.__news_hash(result['news']),
-                }
-                logger.debug(f"Garbage news added : {garbage}")
-                garbage_tasks.append(Cleaner.save_no_cleaned_news(garbage))
-                garbage_news.append(news)
-            if garbage_tasks:
-                await asyncio.gather(*garbage_tasks)
-        return revise_data(data['news'], garbage_news)
+        clean_news, garbage = await Cleaner.partition_news(data)
+        await Cleaner.save_no_cleaned_news(garbage)
+        return clean_news
 
     @staticmethod
     def eliminate_html_tag_decoder(text: str):
-        import html
-        return html.unescape(text)
+        return html_decoder.unescape(text)
 
     @staticmethod
     def __news_hash(news: dict) -> str:
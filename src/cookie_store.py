@@ -0,0 +1,117 @@
+import asyncio
+import heapq
+import time
+from typing import Awaitable, Callable
+import logging
+import src.logging_config
+
+logger = logging.getLogger("CookieStore")
+
+
+class CookieStore:
+    """
+    Cookies of the websites indexed by base URL, with the contents of the pages loaded by the browser.
+    Cookies item: {'url': base url, 'cookies': {'name': 'value'}, 'expires': timestamp}
+    The expired items are evicted by order of expiration, and the refresh of the cookies of a website is done one time
+    even if many requests need it in the same time.
+    """
+    max_items = 1000
+    # Time in seconds the content of a page loaded by the browser is used
+    content_ttl = 300
+    items: dict[str, dict] = {}
+    expirations: list[tuple[float, str]] = []
+    refreshing: dict[str, asyncio.Task] = {}
+    contents: dict[str, tuple[float, str]] = {}
+    is_loaded = False
+
+    @staticmethod
+    def load(items: list[dict]):
+        """
+        Load the cookies saved in the file
+        :param items: list of cookies items
+        """
+        CookieStore.items = {}
+        CookieStore.expirations = []
+        for item in items:
+            CookieStore.put(item)
+        CookieStore.evict()
+        CookieStore.is_loaded = True
+        logger.info(f"{len(CookieStore.items)} cookies items loaded")
+
+    @staticmethod
+    def put(item: dict):
+        CookieStore.items[item['url']] = item
+        heapq.heappush(CookieStore.expirations, (item['expires'], item['url']))
+        if len(CookieStore.items) > CookieStore.max_items:
+            CookieStore.evict(force=len(CookieStore.items) - CookieStore.max_items)
+
+    @staticmethod
+    def evict(force: int = 0):
+        """
+        Remove the expired items, ordered by expiration time
+        :param force: number of items to remove even if not expired, the items that expire first
+        """
+        now = time.time()
+        while CookieStore.expirations:
+            expires, url = CookieStore.expirations[0]
+            item = CookieStore.items.get(url)
+            if item is None or item['expires'] != expires:
+                # the item removed or replaced by a new one
+                heapq.heappop(CookieStore.expirations)
+            elif expires <= now or force > 0:
+                heapq.heappop(CookieStore.expirations)
+                del CookieStore.items[url]
+                force -= 1
+                logger.info(f"Cookies of {url} evicted")
+            else:
+                break
+
+    @staticmethod
+    def get(base_url: str):
+        """:return: the cookies item of the website if not expired, else None"""
+        CookieStore.evict()
+        return CookieStore.items.get(base_url)
+
+    @staticmethod
+    async def refresh(base_url: str, harvest: Callable[[], Awaitable[dict]]):
+        """
+        Get new cookies for the website, the callers that need the cookies of the same website in the same time wait
+        the same harvest
+        :param base_url: the base URL of the website
+        :param harvest: coroutine function that returns the new cookies item or None
+        :return: the cookies item, None if no cookies found
+        """
+        task = CookieStore.refreshing.get(base_url)
+        if task is None:
+            logger.info(f"Refresh the cookies of {base_url}")
+            task = asyncio.create_task(CookieStore.__refresh(harvest))
+            CookieStore.refreshing[base_url] = task
+            task.add_done_callback(lambda _: CookieStore.refreshing.pop(base_url, None))
+        else:
+            logger.info(f"Wait the cookies of {base_url} refreshed by other request")
+        return await asyncio.shield(task)
+
+    @staticmethod
+    async def __refresh(harvest: Callable[[], Awaitable[dict]]):
+        item = await harvest()
+        if item:
+            CookieStore.put(item)
+        return item
+
+    @staticmethod
+    def set_content(url: str, content: str):
+        now = time.time()
+        if len(CookieStore.contents) >= CookieStore.max_items:
+            CookieStore.contents = {key: value for key, value in CookieStore.contents.items() if value[0] > now}
+        CookieStore.contents[url] = (now + CookieStore.content_ttl, content)
+
+    @staticmethod
+    def get_content(url: str):
+        """:return: the content of the page loaded by the browser if not expired, else None"""
+        cached = CookieStore.contents.get(url)
+        if cached is None:
+            return None
+        if cached[0] <= time.time():
+            del CookieStore.contents[url]
+            return None
+        return cached[1]
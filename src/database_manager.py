@@ -2,9 +2,13 @@ import asyncio
 
 import sqlalchemy as sa
 import sqlalchemy.orm as so
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from os import environ
 from dotenv import load_dotenv
 from src.models import News, Channel, Base
+from src.link_index import LinkIndex
+from src.db_writer import DBWriter
+from typing import Any, Callable
 import logging
 from datetime import datetime
 import src.logging_config
@@ -12,85 +16,195 @@ load_dotenv('./.env')
 logger = logging.getLogger("DatabaseManager")
 
 
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new connection of SQLite, WAL let the reads run when a write is running"""
+    cursor = dbapi_connection.cursor()
+    for pragma in ManageDB.pragmas:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+
 class ManageDB:
-    uri = "sqlite:///news_db.db"
+    # SQLite database, DATABASE_URL like "sqlite:////data/news_db.db", the workers of the distributed mode share one file
+    uri = environ.get('DATABASE_URL', "sqlite:///news_db.db")
+    pragmas = [
+        "journal_mode=WAL",
+        "synchronous=NORMAL",
+        "cache_size=-65536",  # 64MB
+        "mmap_size=268435456",  # 256MB
+        "temp_store=MEMORY",
+    ]
+    # number of news inserted by statement
+    batch_size = 500
     engine = sa.create_engine(uri)
-    Session = so.sessionmaker(bind=engine)
-    session = Session()
+    sa.event.listen(engine, "connect", set_sqlite_pragmas)
+    Session = so.sessionmaker(bind=engine, expire_on_commit=False)
+    # all the writes are done by one thread, the reads by short-lived sessions in other threads
+    writer = DBWriter(Session)
+    link_index = LinkIndex()
+
+    @staticmethod
+    def __read(query: Callable[[so.Session], Any]):
+        with ManageDB.Session() as session:
+            return query(session)
+
+    @staticmethod
+    async def read(query: Callable[[so.Session], Any]):
+        """
+        Run a read in its own session, without blocking the event loop
+        :param query: function that takes the session and returns the result
+        """
+        return await asyncio.to_thread(ManageDB.__read, query)
+
+    @staticmethod
+    async def write(job: Callable[[so.Session], Any]):
+        """
+        Submit a write to the writer, it is committed with the other writes waiting
+        :param job: function that takes the session and returns the result
+        """
+        return await ManageDB.writer.submit(job)
 
     @staticmethod
     async def create_tables():
-        Base.metadata.create_all(ManageDB.engine)
-
-    @staticmethod
-    async def save_news(data: dict, channel_name: str):
-        channel = await ManageDB.get_channel(channel_name)
-        news_objs = []
-        for news in data['data']['news']:
-            try:
-                news_obj = News(
-                        title=news.get('title'),
-                        description=news.get('description'),
-                        publish_date=datetime.strptime(news.get('publish_date'), "%Y-%m-%d %H:%M:%S"),
-                        link=news.get('link'),
-                        saved_date=datetime.now(),
-                        channel_id=channel.channel_id,
-                        base_image_link=news.get('media'),
-                        base_image_path=news.get('media_path'),
-                    )
-                news_objs.append(news_obj)
-                logger.info(f"Add News-{news.get('link')} successfully")
-            except sa.exc.IntegrityError:
-                logger.error(f"News-{news.get('link')} Exist")
-        ManageDB.session.add_all(news_objs)
-        ManageDB.session.commit()
-
-    @staticmethod
-    async def add_channel(channel_info: dict):
-        if not await ManageDB.get_channel(channel_info['name']):
-            channel = Channel(**channel_info)
-            ManageDB.session.add(channel)
-            logger.info(f"Channel-{channel_info['name']} added Successfully")
-        else:
-            logger.error(f"Channel-{channel_info['name']} Exist")
-
-    @staticmethod
-    async def add_channels(channels_info: list[dict]):
-        channels_adders = []
-        for channel_info in channels_info:
-            channels_adders.append(ManageDB.add_channel(channel_info))
-        await asyncio.gather(*channels_adders)
-        ManageDB.session.commit()
-
-    @staticmethod
-    async def update_number_of_news(channel_name, number_of_news):
-        channel = await ManageDB.get_channel(channel_name)
-        if channel:
-            logger.info(f"Update Number of news to {channel.channel_id}")
-            logger.info(f"Channel {channel.channel_id} state: {so.object_session(channel).is_modified(channel)}")
-            channel.number_of_news += number_of_news
-            ManageDB.session.commit()
-        else:
-            logger.error(f"No channel has name {channel_name}")
+        await asyncio.to_thread(Base.metadata.create_all, ManageDB.engine)
+
+    @staticmethod
+    def __load_link_index():
+        with ManageDB.engine.connect() as connection:
+            number_of_links = connection.scalar(sa.select(sa.func.count(News.news_id)))
+            links = connection.execution_options(yield_per=10000).scalars(
+                sa.select(News.link).where(News.link.is_not(None)))
+            ManageDB.link_index.load(links, number_of_links)
+
+    @staticmethod
+    async def load_link_index():
+        """Load the links of all the news saved to the link index"""
+        await asyncio.to_thread(ManageDB.__load_link_index)
+
+    @staticmethod
+    async def filter_new_links(links: list[str]) -> set[str]:
+        """
+        Find the links not saved in the database, the links found in the link index are checked in the database
+        :param links: list of news links
+        :return: set of the new links
+        """
+        maybe_saved = [link for link in links if ManageDB.link_index.maybe_saved(link)]
+        if not maybe_saved:
+            return set(links)
+
+        def query(session: so.Session):
+            saved = set()
+            for i in range(0, len(maybe_saved), 500):
+                saved.update(session.scalars(sa.select(News.link).where(News.link.in_(maybe_saved[i:i + 500]))))
+            return saved
+
+        return set(links) - await ManageDB.read(query)
+
+    @staticmethod
+    async def save_news(data: dict, channel: Channel) -> dict:
+        """
+        Save the news of a channel, the news that their link exist are skipped
+        :param data: the data returned by the Scraper
+        :param channel: the channel of the news
+        :return: dict object with the number of news `inserted` and `skipped`, and the `links` of the news inserted
+        """
+        saved_date = datetime.now()
+        rows = [
+            {
+                'title': news.get('title'),
+                'description': news.get('description'),
+                'publish_date': datetime.strptime(news.get('publish_date'), "%Y-%m-%d %H:%M:%S"),
+                'link': news.get('link'),
+                'saved_date': saved_date,
+                'channel_id': channel.channel_id,
+                'base_image_link': news.get('media'),
+                'base_image_path': news.get('media_path'),
+            }
+            for news in data['data']['news']
+        ]
+        inserted = await ManageDB.write(lambda session: ManageDB.insert_news(session, rows)) if rows else []
+        for link in inserted:
+            ManageDB.link_index.add(link)
+        result = {'inserted': len(inserted), 'skipped': len(rows) - len(inserted)}
+        logger.info(f"Channel-{channel.name}: {result['inserted']} news added, {result['skipped']} news exist")
+        return {**result, 'links': inserted}
+
+    @staticmethod
+    def insert_news(session: so.Session, rows: list[dict]) -> list[str]:
+        """
+        Insert the news by batches, `INSERT ... ON CONFLICT(link) DO NOTHING` so a news exist does not stop the others.
+        Run in the writer thread.
+        :param session: the session of the transaction
+        :param rows: list of dict objects, the columns of the news
+        :return: the links of the news inserted
+        """
+        inserted = []
+        statement = sqlite_insert(News).on_conflict_do_nothing(index_elements=[News.link])
+        returning = ManageDB.engine.dialect.insert_returning
+        if returning:
+            statement = statement.returning(News.link)
+        for i in range(0, len(rows), ManageDB.batch_size):
+            batch = rows[i:i + ManageDB.batch_size]
+            result = session.execute(statement, batch)
+            # without RETURNING (SQLite < 3.35) all the links are considered inserted
+            inserted.extend(result.scalars() if returning else [row['link'] for row in batch])
+        return inserted
+
+    @staticmethod
+    async def get_channels():
+        return await ManageDB.read(lambda session: session.scalars(sa.select(Channel)).all())
+
+    @staticmethod
+    async def upsert_channels(channels_info: list[dict]):
+        """
+        Insert the channels in one statement, a channel exist (same name) is updated
+        :param channels_info: list of dict objects with the keys 'name', 'base_url', 'rss_url' and 'language'
+        """
+        if not channels_info:
+            return
+        statement = sqlite_insert(Channel)
+        statement = statement.on_conflict_do_update(
+            index_elements=[Channel.name],
+            set_={
+                'base_url': statement.excluded.base_url,
+                'rss_url': statement.excluded.rss_url,
+                'language': statement.excluded.language,
+            },
+        )
+        await ManageDB.write(lambda session: session.connection().execute(statement, channels_info))
+        logger.info(f"{len(channels_info)} channels added or updated")
+
+    @staticmethod
+    async def increment_number_of_news(counts: dict[int, int]):
+        """
+        Add the number of news of many channels in one statement
+        :param counts: dict object channel_id -> number of news to add
+        """
+        if not counts:
+            return
+        statement = (
+            sa.update(Channel)
+            .where(Channel.channel_id == sa.bindparam('id'))
+            .values(number_of_news=Channel.number_of_news + sa.bindparam('count'))
+        )
+        params = [{'id': channel_id, 'count': count} for channel_id, count in counts.items()]
+        await ManageDB.write(lambda session: session.connection().execute(statement, params))
 
     @staticmethod
     async def get_news_by_id(news_id: int):
-        return ManageDB.session.get_one(News, news_id)
+        return await ManageDB.read(lambda session: session.get_one(News, news_id))
 
     @staticmethod
     async def get_news_by_publish_date(publish_date: str):
         format_ = "%Y-%m-%d %H:%M:%S"
         date_obj = datetime.strptime(publish_date, format_)
-        items = ManageDB.session.query(News).filter_by(publish_date=date_obj).all()
-        return items
+        return await ManageDB.read(lambda session: session.query(News).filter_by(publish_date=date_obj).all())
 
     @staticmethod
     async def get_channel(channel_name: str):
-        return ManageDB.session.query(Channel).filter_by(name=channel_name).first()
+        return await ManageDB.read(lambda session: session.query(Channel).filter_by(name=channel_name).first())
 
     @staticmethod
-    async def close_session():
-        if ManageDB.session.is_active:
-            ManageDB.session.close()
-            return
-        logger.debug("Session is not Active")
+    async def close():
+        """Wait the writes in the queue and stop the writer"""
+        await ManageDB.writer.stop()
@@ -0,0 +1,111 @@
+import asyncio
+import queue
+import threading
+import time
+from typing import Any, Callable
+import sqlalchemy.orm as so
+import logging
+import src.logging_config
+from src.metrics import Metrics
+
+logger = logging.getLogger("DBWriter")
+
+
+class DBWriter:
+    """
+    One thread that does all the writes in the database. The coroutines submit write jobs and wait their result without
+    blocking the event loop, the thread groups the jobs waiting in one transaction (one commit for many jobs).
+    A job is a function that takes the session and returns its result.
+    """
+    def __init__(self, session_factory: so.sessionmaker, max_batch: int = 100, max_wait: float = 0.05):
+        """
+        :param session_factory: used to create the session of every transaction
+        :param max_batch: maximum number of jobs in one transaction
+        :param max_wait: seconds the thread wait other jobs before starting the transaction
+        """
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.jobs = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.__run, name="DBWriter", daemon=True)
+            self.thread.start()
+            logger.info("Database writer started")
+
+    async def submit(self, job: Callable[[so.Session], Any]):
+        """
+        Add the job to the queue of the writer
+        :param job: function that takes the session and returns its result
+        :return: the result of the job, its exception raised if failed
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.jobs.put((job, future, loop))
+        return await future
+
+    async def stop(self):
+        """Wait the jobs in the queue and stop the thread"""
+        if self.thread is not None and self.thread.is_alive():
+            self.jobs.put(None)
+            await asyncio.to_thread(self.thread.join)
+            logger.info("Database writer stopped")
+        self.thread = None
+
+    def __next_batch(self):
+        """Wait a job, then take the jobs that come in `max_wait` seconds"""
+        first = self.jobs.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                job = self.jobs.get(timeout=timeout) if timeout > 0 else self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # stop after this batch
+                self.jobs.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def __run(self):
+        while True:
+            batch = self.__next_batch()
+            if batch is None:
+                return
+            try:
+                # the time of the transaction, the jobs and the commit
+                with Metrics.timer('db_commit_seconds'):
+                    with self.session_factory() as session, session.begin():
+                        results = [job(session) for job, _, _ in batch]
+                Metrics.inc('db_write_jobs_total', len(batch))
+                Metrics.inc('db_commits_total')
+                for (_, future, loop), result in zip(batch, results):
+                    loop.call_soon_threadsafe(DBWriter.__resolve, future, result, None)
+                logger.debug(f"{len(batch)} write jobs committed")
+            except Exception:
+                # a job failed, the transaction is rolled back: every job is done in its own transaction
+                for job, future, loop in batch:
+                    try:
+                        with self.session_factory() as session, session.begin():
+                            result = job(session)
+                        loop.call_soon_threadsafe(DBWriter.__resolve, future, result, None)
+                    except Exception as e:
+                        logger.error(f"Write job failed: {e}", exc_info=True)
+                        loop.call_soon_threadsafe(DBWriter.__resolve, future, None, e)
+
+    @staticmethod
+    def __resolve(future: asyncio.Future, result, exception):
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
@@ -0,0 +1,197 @@
+import io
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import feedparser
+from lxml import etree
+import logging
+import src.logging_config
+
+logger = logging.getLogger("FeedParser")
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+MEDIA = "{http://search.yahoo.com/mrss/}"
+CONTENT = "{http://purl.org/rss/1.0/modules/content/}"
+SY = "{http://purl.org/rss/1.0/modules/syndication/}"
+DC = "{http://purl.org/dc/elements/1.1/}"
+
+
+class FeedParser:
+    """
+    Fast parser of RSS 2.0 and Atom feeds using lxml `iterparse`, only the fields used by the Scraper are extracted:
+    title, link, published, summary, content and the media. Every item is cleared after it is parsed, so the memory stay
+    small with the big feeds. The result has the same form of the result of `feedparser` (`feed` and `entries` with the
+    same keys), and `feedparser` is used when the feed is not RSS 2.0 or Atom, or is malformed.
+    """
+    parsers = ('lxml', 'feedparser')
+    # {'lxml': feeds parsed by lxml, 'feedparser': feeds parsed by feedparser, 'fallbacks': lxml failures}
+    stats = {'lxml': 0, 'feedparser': 0, 'fallbacks': 0}
+
+    @staticmethod
+    def parse(content: bytes, parser: str = 'lxml'):
+        """
+        Parse the feed
+        :param content: bytes object that contains the feed
+        :param parser: 'lxml' to use the fast parser, 'feedparser' to use only feedparser
+        :return: FeedParserDict object with the keys `feed` and `entries`
+        """
+        if isinstance(content, str):
+            # the content of the page loaded by the browser
+            content = content.encode()
+        if parser == 'lxml':
+            result = feedparser.FeedParserDict(feed=feedparser.FeedParserDict(), entries=[], bozo=0)
+            try:
+                result['entries'] = list(FeedParser.iter_entries(content, result['feed']))
+                FeedParser.stats['lxml'] += 1
+                return result
+            except (etree.LxmlError, ValueError) as e:
+                FeedParser.stats['fallbacks'] += 1
+                logger.info(f"Feed not parsed by lxml, using feedparser: {e}")
+        FeedParser.stats['feedparser'] += 1
+        return feedparser.parse(content)
+
+    @staticmethod
+    def iter_entries(content: bytes, feed: dict = None):
+        """
+        Parse the feed and yield its entries when they are parsed
+        :param content: bytes object that contains the feed
+        :param feed: dict object completed with the information of the feed (`ttl`, `sy_updateperiod`,
+        `sy_updatefrequency`)
+        :raise ValueError: the feed is not RSS 2.0 or Atom
+        :raise etree.LxmlError: the feed is malformed
+        """
+        feed = feed if feed is not None else {}
+        events = etree.iterparse(io.BytesIO(content), events=('start', 'end'), resolve_entities=False,
+                                 no_network=True)
+        root = None
+        item_tag = None
+        depth = 0
+        for event, element in events:
+            if root is None:
+                root = element
+                if element.tag == 'rss':
+                    item_tag = 'item'
+                elif element.tag == f"{ATOM}feed":
+                    item_tag = f"{ATOM}entry"
+                else:
+                    raise ValueError(f"feed format <{element.tag}> not supported")
+                continue
+            if element.tag == item_tag:
+                depth += 1 if event == 'start' else -1
+                if event == 'end':
+                    yield FeedParser.__rss_entry(element) if item_tag == 'item' else FeedParser.__atom_entry(element)
+                    # the item is not needed after it is parsed
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+            elif event == 'end' and depth == 0:
+                FeedParser.__feed_element(element, feed)
+
+    @staticmethod
+    def __feed_element(element, feed: dict):
+        """Save the elements of the channel used by the Scheduler"""
+        keys = {'ttl': 'ttl', f"{SY}updatePeriod": 'sy_updateperiod', f"{SY}updateFrequency": 'sy_updatefrequency'}
+        key = keys.get(element.tag)
+        if key and element.text:
+            feed[key] = element.text.strip()
+
+    @staticmethod
+    def __text(element):
+        if element is None:
+            return None
+        return ''.join(element.itertext()).strip()
+
+    @staticmethod
+    def __media(element, entry: dict):
+        """Add the media elements of the item to the entry, the same keys of feedparser"""
+        for child in element.iter(f"{MEDIA}thumbnail"):
+            entry.setdefault('media_thumbnail', []).append(dict(child.attrib))
+        for child in element.iter(f"{MEDIA}content"):
+            entry.setdefault('media_content', []).append(dict(child.attrib))
+
+    @staticmethod
+    def __set_published(entry: dict, date: str, rfc822: bool = False):
+        """Add the date of the item and the date parsed in UTC, RFC 822 in RSS and ISO 8601 in Atom and `dc:date`"""
+        if not date:
+            return
+        entry['published'] = date
+        try:
+            published = parsedate_to_datetime(date) if rfc822 else datetime.fromisoformat(date)
+        except (TypeError, ValueError):
+            return
+        if published.tzinfo is None:
+            published = published.replace(tzinfo=timezone.utc)
+        entry['published_parsed'] = published.utctimetuple()
+
+    @staticmethod
+    def __rss_entry(element) -> dict:
+        entry = feedparser.FeedParserDict()
+        for key in ('title', 'link', 'description'):
+            text = FeedParser.__text(element.find(key))
+            if text is not None:
+                entry['summary' if key == 'description' else key] = text
+        encoded = element.find(f"{CONTENT}encoded")
+        if encoded is not None and encoded.text:
+            entry['content'] = [{'value': encoded.text}]
+        pub_date = FeedParser.__text(element.find('pubDate'))
+        if pub_date:
+            FeedParser.__set_published(entry, pub_date, rfc822=True)
+        else:
+            FeedParser.__set_published(entry, FeedParser.__text(element.find(f"{DC}date")))
+        # the enclosures are links, like in feedparser
+        entry['links'] = [{'rel': 'alternate', 'href': entry['link']}] if entry.get('link') else []
+        for enclosure in element.findall('enclosure'):
+            entry['links'].append({
+                'rel': 'enclosure',
+                'href': enclosure.get('url'),
+                'type': enclosure.get('type'),
+                'length': enclosure.get('length'),
+            })
+        FeedParser.__media(element, entry)
+        return entry
+
+    @staticmethod
+    def __xhtml(element) -> str:
+        """The HTML of an Atom xhtml content, without its `div` and the XHTML namespace"""
+        # a copy out of the feed, so the namespaces of the feed are not inherited
+        div = etree.fromstring(etree.tostring(element[0] if len(element) == 1 else element))
+        for child in div.iter():
+            if isinstance(child.tag, str):
+                child.tag = etree.QName(child).localname
+        etree.cleanup_namespaces(div)
+        return (div.text or '') + ''.join(etree.tostring(child, encoding='unicode') for child in div)
+
+    @staticmethod
+    def __atom_entry(element) -> dict:
+        entry = feedparser.FeedParserDict()
+        title = FeedParser.__text(element.find(f"{ATOM}title"))
+        if title is not None:
+            entry['title'] = title
+        entry['links'] = []
+        for link in element.findall(f"{ATOM}link"):
+            rel = link.get('rel', 'alternate')
+            if rel == 'alternate' and 'link' not in entry:
+                entry['link'] = link.get('href')
+            entry['links'].append({
+                'rel': rel,
+                'href': link.get('href'),
+                'type': link.get('type'),
+                'length': link.get('length'),
+            })
+        content = element.find(f"{ATOM}content")
+        if content is not None:
+            if content.get('type') == 'xhtml':
+                value = FeedParser.__xhtml(content)
+            else:
+                value = content.text or ''
+            entry['content'] = [{'value': value}]
+        summary = element.find(f"{ATOM}summary")
+        if summary is not None:
+            entry['summary'] = summary.text or ''
+        elif content is not None:
+            entry['summary'] = entry['content'][0]['value']
+        # the date of update used when the entry has no date of publication
+        date = FeedParser.__text(element.find(f"{ATOM}published")) or \
+            FeedParser.__text(element.find(f"{ATOM}updated"))
+        FeedParser.__set_published(entry, date)
+        FeedParser.__media(element, entry)
+        return entry
@@ -0,0 +1,57 @@
+import time
+import logging
+import src.logging_config
+from src.buffering import Buffering, KeyValueJournal
+
+logger = logging.getLogger("FeedProfile")
+
+
+class FeedProfile:
+    """
+    What the program learned about every feed, so the next polls go directly to the way that worked. Saved in
+    `files/feed_profiles.jsonl` by rss url:
+    {
+        'date_format': name of the format of the dates of the feed (see `Scraper.date_parsers`),
+        'timezone': UTC offset of the dates, like '+0200', used for the dates of the feed without offset,
+        'media_source': where the images are in the feed ('media_thumbnail', 'media_content', 'enclosures', 'html'),
+        None if the feed has no image,
+        'access': how the feed is reached, 'direct', 'cookies' (403 handled by cookies) or 'browser',
+        'article_access': how the articles of the channel are reached, the same values,
+        'item_count': the usual number of items of the feed, the small feeds are parsed without a thread,
+        'updated': timestamp of the last change
+    }
+    A value is learned again only when it fails.
+    """
+    # weight of the last poll in the usual number of items
+    item_count_smoothing = 0.3
+
+    @staticmethod
+    def __buffer() -> KeyValueJournal:
+        if not Buffering.feed_profiles_buffer:
+            Buffering.feed_profiles_buffer = Buffering.open_feed_profiles_buffer()
+        return Buffering.feed_profiles_buffer
+
+    @staticmethod
+    def get(rss_url: str) -> dict:
+        """:return: the profile of the feed, empty dict if nothing learned"""
+        return FeedProfile.__buffer().get_item(rss_url, {})
+
+    @staticmethod
+    def update(rss_url: str, **values):
+        """Change some values of the profile of the feed, saved only if a value changed"""
+        profile = FeedProfile.get(rss_url)
+        changed = {key: value for key, value in values.items() if profile.get(key, ...) != value}
+        if not changed:
+            return
+        FeedProfile.__buffer().set_item(rss_url, {**profile, **changed, 'updated': time.time()})
+        if set(changed) != {'item_count'}:
+            logger.info(f"Profile of {rss_url} learned {changed}")
+
+    @staticmethod
+    def update_item_count(rss_url: str, item_count: int):
+        """Add the number of items of the last poll to the usual number of items, saved only if it changed"""
+        previous = FeedProfile.get(rss_url).get('item_count')
+        if previous is not None:
+            item_count = round(FeedProfile.item_count_smoothing * item_count
+                               + (1 - FeedProfile.item_count_smoothing) * previous)
+        FeedProfile.update(rss_url, item_count=item_count)
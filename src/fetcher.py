@@ -0,0 +1,188 @@
+import asyncio
+import httpx
+import logging
+from contextlib import asynccontextmanager
+from importlib.util import find_spec
+from urllib import parse
+import src.logging_config
+from src.retry import Retry
+from src.cassette import Cassette
+from src.metrics import Metrics
+
+logger = logging.getLogger("Fetcher")
+
+
+class Fetcher:
+    """
+    The fetch layer shared by all the program, it holds one long-lived `httpx.AsyncClient` so all the requests
+    reuse the same pool of keep-alive connections, and limit how much requests run in the same time, globally
+    and for every host.
+    """
+    # Pool settings
+    max_connections = 100
+    max_keepalive_connections = 20
+    # Concurrency limits, `max_per_host` keep us polite with every website
+    max_concurrency = 50
+    max_per_host = 4
+    # HTTP/2 used only if the `h2` package is installed
+    http2 = True
+    # Timeout budget in seconds of every type of request, the budget cover all the request (connect, send, read)
+    budgets = {
+        'rss': 30,
+        'article': 15,
+        'image': 30,
+    }
+    connect_timeout = 5
+    client: httpx.AsyncClient = None
+    global_semaphore: asyncio.Semaphore = None
+    host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+    @staticmethod
+    async def open_client():
+        """Create the shared client, if it is already open nothing change"""
+        if Fetcher.client is not None and not Fetcher.client.is_closed:
+            return Fetcher.client
+        http2 = Fetcher.http2 and find_spec('h2') is not None
+        if Fetcher.http2 and not http2:
+            logger.info("Package `h2` not installed, HTTP/2 disabled")
+        limits = httpx.Limits(
+            max_connections=Fetcher.max_connections,
+            max_keepalive_connections=Fetcher.max_keepalive_connections,
+        )
+        # the cassette records the responses of the transport, or replay them without network
+        transport = Cassette.transport(httpx.AsyncHTTPTransport(limits=limits, http2=http2))
+        Fetcher.client = httpx.AsyncClient(
+            transport=transport,
+            follow_redirects=True,
+            timeout=httpx.Timeout(max(Fetcher.budgets.values()), connect=Fetcher.connect_timeout),
+        )
+        Fetcher.global_semaphore = asyncio.Semaphore(Fetcher.max_concurrency)
+        Fetcher.host_semaphores = {}
+        logger.info(f"HTTP client is opened (http2={http2}, max_connections={Fetcher.max_connections}, "
+                    f"cassette={Cassette.mode})")
+        return Fetcher.client
+
+    @staticmethod
+    async def close_client():
+        if Fetcher.client is not None and not Fetcher.client.is_closed:
+            await Fetcher.client.aclose()
+            logger.info("HTTP client is closed")
+        Fetcher.client = None
+
+    @staticmethod
+    def __host_semaphore(url: str) -> asyncio.Semaphore:
+        host = parse.urlparse(url).hostname or ''
+        semaphore = Fetcher.host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(Fetcher.max_per_host)
+            Fetcher.host_semaphores[host] = semaphore
+        return semaphore
+
+    @staticmethod
+    def __build_headers(headers: dict = None, cookies: dict = None) -> dict:
+        """Cookies are sent in the `cookie` header, the client stay without any cookie jar shared between hosts"""
+        headers = dict(headers) if headers else {}
+        if cookies:
+            headers['cookie'] = '; '.join(f"{name}={value}" for name, value in cookies.items())
+        return headers
+
+    @staticmethod
+    @asynccontextmanager
+    async def limit(url: str):
+        """Wait a free slot in the global limit and the host limit of the url"""
+        await Fetcher.open_client()
+        async with Fetcher.global_semaphore:
+            async with Fetcher.__host_semaphore(url):
+                yield
+
+    @staticmethod
+    async def get(url: str, request_type: str = 'rss', headers: dict = None, cookies: dict = None,
+                  max_attempts: int = None, base_delay: float = None) -> httpx.Response:
+        """
+        Send GET request using the shared client, the request is retried if failed by a server or transport error
+        :param url: requested URL
+        :param request_type: one of the keys of `Fetcher.budgets`, define the timeout budget of every attempt
+        :param headers: request headers
+        :param cookies: dict object of cookies 'name' and 'value' sent with the request
+        :param max_attempts: number of retries, default `Retry.max_attempts`
+        :param base_delay: delay of the first retry, default `Retry.base_delay`
+        :return: the response, the body is loaded
+        """
+        budget = Fetcher.budgets[request_type]
+        headers = Fetcher.__build_headers(headers, cookies)
+        host = parse.urlparse(url).hostname if Metrics.enabled else None
+
+        async def send():
+            # the slot is free during the wait between attempts
+            async with Fetcher.limit(url):
+                try:
+                    with Metrics.timer('fetch_seconds', 'fetch_in_flight', host=host, type=request_type):
+                        response = await asyncio.wait_for(Fetcher.client.get(url, headers=headers), timeout=budget)
+                except asyncio.TimeoutError:
+                    Metrics.inc('fetch_errors_total', host=host, error='timeout')
+                    raise httpx.TimeoutException(f"Request to <{url}> exceed its budget of {budget}s")
+                except httpx.TransportError as e:
+                    Metrics.inc('fetch_errors_total', host=host, error=type(e).__name__)
+                    raise
+                Metrics.inc('fetch_responses_total', host=host, status=response.status_code)
+                return response
+
+        return await Retry.call(send, url, max_attempts, base_delay)
+
+    @staticmethod
+    @asynccontextmanager
+    async def stream(url: str, request_type: str = 'image', headers: dict = None, cookies: dict = None):
+        """
+        Send GET request using the shared client without loading the body, used with `async with`. The request is
+        retried if failed before reading the body. The budget of every attempt cover the wait of the headers and the
+        reading of the body by the caller, when it is exceeded `httpx.TimeoutException` is raised in the caller.
+        :param url: requested URL
+        :param request_type: one of the keys of `Fetcher.budgets`, define the timeout budget of every attempt
+        :param headers: request headers
+        :param cookies: dict object of cookies 'name' and 'value' sent with the request
+        :return: the response, the body is read using `response.aiter_bytes()`
+        """
+        budget = Fetcher.budgets[request_type]
+        timeout = httpx.Timeout(budget, connect=Fetcher.connect_timeout)
+        headers = Fetcher.__build_headers(headers, cookies)
+        host = parse.urlparse(url).hostname if Metrics.enabled else None
+        attempt = 0
+        while True:
+            async with Fetcher.limit(url):
+                request = Fetcher.client.build_request('GET', url, headers=headers, timeout=timeout)
+                deadline = asyncio.get_running_loop().time() + budget
+                try:
+                    # the time until the headers, the body is read by the caller
+                    with Metrics.timer('fetch_seconds', 'fetch_in_flight', host=host, type=request_type):
+                        try:
+                            async with asyncio.timeout_at(deadline):
+                                response = await Fetcher.client.send(request, stream=True)
+                        except asyncio.TimeoutError:
+                            raise httpx.TimeoutException(f"Request to <{url}> exceed its budget of {budget}s",
+                                                         request=request)
+                except httpx.TransportError as e:
+                    Metrics.inc('fetch_errors_total', host=host, error=type(e).__name__)
+                    delay = Retry.next_delay(attempt)
+                    if delay is None:
+                        raise
+                else:
+                    Metrics.inc('fetch_responses_total', host=host, status=response.status_code)
+                    delay = None
+                    if response.status_code in Retry.retry_statuses:
+                        delay = Retry.next_delay(attempt, response)
+                    if delay is None:
+                        try:
+                            # the slow body is stopped at the end of the budget, the slots are not held forever
+                            async with asyncio.timeout_at(deadline):
+                                yield response
+                        except asyncio.TimeoutError:
+                            Metrics.inc('fetch_errors_total', host=host, error='timeout')
+                            raise httpx.TimeoutException(f"Request to <{url}> exceed its budget of {budget}s",
+                                                         request=request)
+                        finally:
+                            await response.aclose()
+                        return
+                    await response.aclose()
+            logger.info(f"Retry <{url}> after {delay:.2f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -1,7 +1,12 @@
 import time, httpx, random
-from typing import Union
 from playwright import async_api
-from src.buffering import JSONBuffer, Buffering, CSVBuffer
+from src.buffering import JSONBuffer, Buffering, JournalBuffer
+from src.fetcher import Fetcher
+from src.browser_pool import BrowserPool
+from src.cookie_store import CookieStore
+from src.cassette import Cassette
+from src.retry import Retry
+from src.retry_queue import RetryQueue
 from os import environ
 import logging
 import src.logging_config
@@ -10,8 +15,8 @@ logger = logging.getLogger("ErrorHandler")
 
 
 class ErrorHandler:
-    CONTENT = None
-    chrome_path = "path/to/chrome.exe"
+    # Time in seconds the cookies without expiration date are used
+    session_cookies_ttl = 3600
 
     @staticmethod
     def get_request_id(with_proxy: bool = False, previous_ua: str = None, previous_proxy: dict = None):
@@ -59,77 +64,95 @@ class ErrorHandler:
 
 
     @staticmethod
-    async def handle_server_echec(url: tuple, request: Union[httpx.Request, None] = None, n_requests: int = 5, delay: float = 3, url_type: str = 'rss') -> dict:
+    async def handle_server_echec(url: tuple, n_requests: int = 5, delay: float = 3, url_type: str = 'rss') -> dict:
         """
         Handle the server echec get it by the status code 500~5011, by make request until the server response
-        with a delay and n_request.
-        delay: how much can I wait until make other request.
+        with a delay and n_request. The wait between requests grow exponentially from delay, and do not block the others
+        requests. The requests of `Fetcher` are already retried, use this function to insist more on a server.
+        delay: how much can I wait until make the second request.
         n_request: how much of request can make to that server
         It returns dictionary with two case different:
         case1: the error handle. It returns the data get it from the website
         case2: the error still showed. It returns an error data, that give you a view of what happen
 
         """
-        if not request:
-            request = httpx.Request(url=url[-1], method="GET")
-        with httpx.Client() as client:
-            logger.info(f"start 5xx status code handle for `{url[-1]}`")
-            for i in range(n_requests):
-                response = client.send(request)
-                if response.status_code == 200 and url_type == 'rss':
-                    logger.info(f"5xx status handled. Make {i}-request to {url}")
-                    return {
-                        'status': True,
-                        'data': {
-                            'content': response.content,
-                            'requests_sent': i,
-                            'delay': delay,
-                        }
-                    }
-                elif response.status_code in range(500, 506):
-                    time.sleep(delay)
-                    continue
-                else:
-                    break
-        logger.debug(f"5xx status for {url[-1]} not handled after {i}-request")
+        logger.info(f"start 5xx status code handle for `{url[-1]}`")
+        attempts = 0
+
+        async def send():
+            nonlocal attempts
+            attempts += 1
+            return await Fetcher.get(url[-1], url_type, max_attempts=0)
+
+        try:
+            response = await Retry.call(send, url[-1], max_attempts=n_requests - 1, base_delay=delay)
+        except httpx.HTTPError as e:
+            logger.error(f"Exception: {e}")
+            response = None
+        if response is not None and response.status_code == 200:
+            logger.info(f"5xx status handled. Make {attempts}-request to {url}")
+            return {
+                'status': True,
+                'data': {
+                    'content': response.content,
+                    'requests_sent': attempts,
+                    'delay': delay,
+                }
+            }
+        logger.debug(f"5xx status for {url[-1]} not handled after {attempts}-request")
         return {
             'status': False,
             'data': {
                 'work_on': url[-1],
                 'date': time.time(),
-                'error': response.status_code,
-                'user_agent': response.request.headers['user-agent'],
+                'error': response.status_code if response is not None else 0,
+                'user_agent': response.request.headers.get('user-agent') if response is not None else None,
                 'delay': delay,
-                'requests_sent': n_requests,
+                'requests_sent': attempts,
             }
         }
 
     @staticmethod
     async def handle_403(url: str):
         """This function handle the error 403, by make a request with a legitimate cookies"""
+        content, _ = await ErrorHandler.get_protected_content(url)
+        return content
+
+    @staticmethod
+    async def get_protected_content(url: str, access: str = None):
+        """
+        Get the content of a page that refuse the requests without cookies, the same as `handle_403`
+        :param url: the URL of the page
+        :param access: the way that worked the last time for the website, 'browser' to go directly to the browser.
+        If it fails every way is tried.
+        :return: tuple (content, access), access is 'cookies' if the request with cookies worked, 'browser' if the
+        content is loaded by the browser, (None, None) if no content
+        """
+        if access == 'browser':
+            content = CookieStore.get_content(url) or await ErrorHandler.get_content(url)
+            if content:
+                return content, 'browser'
         logger.info(f"Handling the error 403 for {url}")
         cookies = await ErrorHandler.get_cookies(url, Buffering.cookies_buffer)
         if cookies is None:
             logger.error(f"No cookies to handle 403 error for url:<{url}>")
-            return None
+            return None, None
         try:
-            async with httpx.AsyncClient(cookies=cookies['cookies'], follow_redirects=True) as client:
-
-                logger.info(f"Sending request to {url} with cookies")
-                response = await client.get(url, timeout=5)
-                logger.info(f"Status code <{response.status_code}, {url}>")
-                # ErrorHandler.CONTENT used when the first time we get the cookies we get also the content of the page
-                # to avoid repetition
-                if response.status_code != 200:
-                    if ErrorHandler.CONTENT:
-                        return ErrorHandler.CONTENT
+            logger.info(f"Sending request to {url} with cookies")
+            response = await Fetcher.get(url, 'article', cookies=cookies['cookies'])
+            logger.info(f"Status code <{response.status_code}, {url}>")
+            # when we get the cookies we get also the content of the page, used to avoid repetition
+            if response.status_code != 200:
+                content = CookieStore.get_content(url)
+                if not content:
                     logger.info("Using Headless browser to get the content")
-                    return await ErrorHandler.get_content(url)
+                    content = await ErrorHandler.get_content(url)
+                return (content, 'browser') if content else (None, None)
             logger.info(f"403 status code handled for {url}")
-            return response.content
+            return response.content, 'cookies'
         except httpx.HTTPError as e:
             logger.error(f"Exception when handling 403 error for {url}: {e}", exc_info=True)
-            return None
+            return None, None
 
     @staticmethod
     def get_base_url(url: str) -> str:
@@ -150,84 +173,87 @@ class ErrorHandler:
         :param cookies: dict object that content the cookies
         :return: the min expired time of those cookies related to that website
         """
-        return min(filter(lambda v: v, [cookie[-1] for cookie in cookies.values()]))
+        expires = [cookie[-1] for cookie in cookies.values() if cookie[-1] and cookie[-1] > 0]
+        # session cookies has no expiration date (-1)
+        return min(expires, default=time.time() + ErrorHandler.session_cookies_ttl)
 
     @staticmethod
     async def get_content(url: str):
         """
-        Get page content, using playwright
+        Get page content, using a page of the browser pool
         :param url: scraped website
         :return: the content of the page
         """
+        if Cassette.mode == 'replay':
+            content_ = await Cassette.get_content('browser', url)
+            if content_ is not None:
+                CookieStore.set_content(url, content_)
+            return content_
         try:
-            async with async_api.async_playwright() as playwright:
-                browser = await playwright.chromium.launch(
-                    executable_path=ErrorHandler.chrome_path,
-                    headless=True
-                )
-                context = await browser.new_context()
-                page = await context.new_page()
-                await page.goto(url, timeout=60000)
+            started = time.perf_counter()
+            async with BrowserPool.page() as (context, page):
+                await page.goto(url)
                 await page.wait_for_selector("body")
                 content_ = await page.content()
+            Cassette.save_content('browser', url, content_, time.perf_counter() - started)
+            CookieStore.set_content(url, content_)
             return content_
         except async_api.Error as e:
             logger.error(f"Exception from `get_content` for url:<{url}>: {e}")
 
     @staticmethod
     async def get_new_cookies(url: str):
-        """ Use playwright to get cookies from the website
+        """ Use a page of the browser pool to get cookies from the website, images, fonts and media are not loaded
         :param url: from where we get the cookies
         :return: dict object that contents all the cookies 'name' and 'value'
         """
+        if Cassette.mode == 'replay':
+            recorded = await Cassette.get_content('cookies', url)
+            if recorded is None:
+                return None
+            CookieStore.set_content(url, recorded['content'])
+            return recorded['cookies']
         try:
-            async with async_api.async_playwright() as playwright:
-                browser = await playwright.chromium.launch(
-                    executable_path=ErrorHandler.chrome_path,
-                    headless=True,
-                )
-                context = await browser.new_context()
-                page = await context.new_page()
-                await page.goto(url, timeout=60000)
+            started = time.perf_counter()
+            async with BrowserPool.page(block_resources=True) as (context, page):
+                await page.goto(url)
                 await page.wait_for_selector("body")
-                ErrorHandler.CONTENT = await page.content()
-                new_cookies = {cookie['name']: [cookie['value'], cookie['expires']] for cookie in await context.cookies()}
+                content_ = await page.content()
+                CookieStore.set_content(url, content_)
+                new_cookies = {cookie['name']: [cookie['value'], cookie['expires']] for cookie in await context.cookies(url)}
+            Cassette.save_content('cookies', url, {'cookies': new_cookies, 'content': content_},
+                                  time.perf_counter() - started)
             return new_cookies
         except async_api.Error as e:
             logger.error(f"Exception from `get_new_cookies` for url:<{url}>: {e}")
             return None
 
     @staticmethod
-    async def get_cookies(url: str, buffer: JSONBuffer):
+    async def get_cookies(url: str, buffer: JournalBuffer):
 
-        """This function check the cookies if exist in the cookies_buffer that related to 'cookies.json' file
-        if the cookies exist and the expired time calculated by __min_expires_cookies > time.time(), use it
-        else we get the cookies and also if the buffer is empty
+        """This function check the cookies if exist in the cookie store loaded from the cookies_buffer that related to
+        'cookies.jsonl' file, if the cookies exist and the expired time calculated by __min_expires_cookies > time.time(),
+        use it else we get the cookies. The requests that need the cookies of the same website in the same time wait the
+        same browser.
         :param url: website from where we get the cookies
         :param buffer: the buffer used to store all the cookies used by the program, 'cookies_buffer'
-        :return: buffer, used to save the data in 'cookies.json' file and close the buffer"""
+        :return: cookies item {'url': base url, 'cookies': cookies, 'expires': expired time}"""
 
-        buffer_content = buffer.get_buffer()
+        if not CookieStore.is_loaded:
+            CookieStore.load(buffer.iter_items() if buffer else [])
         base_url = ErrorHandler.get_base_url(url)
-        get_cookies_try = 3
-        if buffer_content:
-            favorable_item = list(filter(lambda item: item['url'] == base_url, buffer_content))
-            if not favorable_item:
-                logger.info(f"No cookies favorable for {base_url}")
-            else:
-                logger.info("Cookies exist in the buffer")
-                logger.info("Check expired time")
-                if favorable_item[0]['expires'] > time.time():
-                    logger.info("Cookies not expired")
-                    return favorable_item[0]
-                else:
-                    logger.info("Cookies expired")
-                    buffer.buffer.remove(favorable_item[0])
-        else:
-            logger.info("Nothing in the buffer")
-            logger.info(f"No cookies favorable for {base_url}")
+        item = CookieStore.get(base_url)
+        if item:
+            logger.info(f"Cookies of {base_url} exist and not expired")
+            return item
+        logger.info(f"No cookies favorable for {base_url}")
+        return await CookieStore.refresh(base_url, lambda: ErrorHandler.__harvest_cookies(url, base_url, buffer))
 
+    @staticmethod
+    async def __harvest_cookies(url: str, base_url: str, buffer: JournalBuffer):
+        """Get new cookies using the browser, try 4 times"""
         logger.info(f"Get new cookies")
+        get_cookies_try = 3
         new_cookies = await ErrorHandler.get_new_cookies(url)
         while not new_cookies and get_cookies_try != 0:
             new_cookies = await ErrorHandler.get_new_cookies(url)
@@ -237,30 +263,25 @@ class ErrorHandler:
             return None
         expires = ErrorHandler.__min_expires_cookies(new_cookies)
         new_cookies = {key: value[0] for key, value in new_cookies.items()}
-        cookies_buffer_item = {'url': base_url, 'cookies': new_cookies, 'expires': expires}
-        buffer.add_item(cookies_buffer_item)
-        logger.info(f"{base_url} cookies added to the buffer")
-        return cookies_buffer_item
+        cookies_item = {'url': base_url, 'cookies': new_cookies, 'expires': expires}
+        if buffer:
+            buffer.add_item(cookies_item)
+        logger.info(f"{base_url} cookies added to the cookie store")
+        return cookies_item
 
     @staticmethod
     async def not_handled_websites(data: dict, after: float = 500):
         """
         The websites that return error status code and not reach its data. this function
-        save the state of those website in a csv file, for later test
+        add those website to the retry queue, they are scraped again when their time is reached
         :param data: Error data returned by the Scraper
-        :param after: much of time wait to resent request again
+        :param after: much of time wait to resent request again, doubled for every new failure
         """
+        if RetryQueue.journal is None:
+            if not Buffering.not_handled_urls_buffer:
+                Buffering.not_handled_urls_buffer = Buffering.open_not_handled_urls_buffer()
+            RetryQueue.load(Buffering.not_handled_urls_buffer)
+        item = RetryQueue.push(data['data']['work_on'], data['data']['error'], data['data']['date'], after)
         logger.error(
-            f"{data['data']['work_on']} status saved in `not_handled_urls.csv` with status code <{data['data']['error']}> test after {after}")
-        item = {
-            'URL': data['data']['work_on'],
-            'Status code': data['data']['error'],
-            'Time of fail': data['data']['date'],
-            'Time of resent': time.time() + after,
-        }
-        if not Buffering.not_handled_urls_buffer:
-            headers = ['URL', 'Status code', 'Time of fail', 'Time of resent']
-            Buffering.not_handled_urls_buffer = CSVBuffer('not_handled_urls.csv', headers)
-        Buffering.not_handled_urls_buffer.add_item(item)
-
-
+            f"{data['data']['work_on']} saved in the retry queue with status code <{data['data']['error']}> "
+            f"test after {item['due'] - time.time():.0f}s ({item['failures']} failures)")
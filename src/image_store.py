@@ -0,0 +1,147 @@
+import asyncio
+import os
+import re
+import uuid
+import httpx
+from hashlib import sha256
+import logging
+import src.logging_config
+from src.fetcher import Fetcher
+from src.metrics import Metrics
+
+logger = logging.getLogger("ImageStore")
+
+
+class ImageStore:
+    """
+    Save the images of the news on the disk. The image is named by the hash of its content, so the same image used by
+    many news (or many channels) is saved one time: images/<first two characters of hash>/<hash>.<extension>
+    """
+    directory = 'images'
+    max_size = 10 * 1024 * 1024  # 10MB
+    chunk_size = 64 * 1024
+    max_concurrency = 8
+    semaphore: asyncio.Semaphore = None
+    extensions = {
+        'image/jpeg': '.jpg',
+        'image/jpg': '.jpg',
+        'image/pjpeg': '.jpg',
+        'image/png': '.png',
+        'image/gif': '.gif',
+        'image/webp': '.webp',
+        'image/avif': '.avif',
+        'image/bmp': '.bmp',
+        'image/svg+xml': '.svg',
+        'image/x-icon': '.ico',
+    }
+    # extension of the images of a type not in `extensions` and not found by their magic bytes
+    default_extension = '.img'
+    # Magic bytes used when the server did not send the type of the image
+    signatures = {
+        b'\xff\xd8\xff': '.jpg',
+        b'\x89PNG\r\n\x1a\n': '.png',
+        b'GIF87a': '.gif',
+        b'GIF89a': '.gif',
+        b'BM': '.bmp',
+    }
+
+    @staticmethod
+    def __sniff_extension(chunk: bytes):
+        if chunk[:4] == b'RIFF' and chunk[8:12] == b'WEBP':
+            return '.webp'
+        if chunk[4:12] in (b'ftypavif', b'ftypavis'):
+            return '.avif'
+        for signature, extension in ImageStore.signatures.items():
+            if chunk.startswith(signature):
+                return extension
+        return None
+
+    @staticmethod
+    def __type_extension(content_type: str):
+        """
+        The extension of an image type not known, from its subtype: 'image/tiff' -> '.tiff', 'image/x-dcraw' -> '.dcraw'
+        :return: the extension, `default_extension` if the subtype has no valid character
+        """
+        subtype = content_type.partition('/')[2].split('+')[0]
+        subtype = re.sub(r"[^a-z0-9.-]", '', subtype.removeprefix('x-')).strip('.-')
+        return f".{subtype}" if subtype else ImageStore.default_extension
+
+    @staticmethod
+    def __path(hash_code: str, extension: str) -> str:
+        return os.path.join(ImageStore.directory, hash_code[:2], hash_code + extension)
+
+    @staticmethod
+    async def save(image_link: str):
+        """
+        Download the image and save it in the store, the body is written to the disk by chunks. An image bigger than
+        `ImageStore.max_size` or a response that is not an image is dropped.
+        :param image_link: URL of the image
+        :return: the absolute path of the image, None if not saved
+        """
+        if ImageStore.semaphore is None:
+            ImageStore.semaphore = asyncio.Semaphore(ImageStore.max_concurrency)
+        temp_directory = os.path.join(ImageStore.directory, 'tmp')
+        os.makedirs(temp_directory, exist_ok=True)
+        temp_path = os.path.join(temp_directory, f"{uuid.uuid4().hex}.part")
+        try:
+            async with ImageStore.semaphore, Fetcher.stream(image_link, 'image') as response:
+                logger.info(f"Saving image for <{image_link}> with status code {response.status_code}")
+                if response.status_code != 200:
+                    return None
+                content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+                content_length = response.headers.get('content-length')
+                if content_length and content_length.isdigit() and int(content_length) > ImageStore.max_size:
+                    logger.error(f"Image <{image_link}> dropped, size {content_length} bytes")
+                    return None
+                if content_type and not content_type.startswith('image/') and content_type != 'application/octet-stream':
+                    logger.error(f"Image <{image_link}> dropped, content type <{content_type}>")
+                    return None
+                extension = ImageStore.extensions.get(content_type)
+                hash_code = sha256()
+                size = 0
+                with open(temp_path, 'wb') as image:
+                    async for chunk in response.aiter_bytes(ImageStore.chunk_size):
+                        if size == 0 and extension is None:
+                            extension = ImageStore.__sniff_extension(chunk)
+                            # the server said it is an image, of a type not known
+                            if extension is None and content_type.startswith('image/'):
+                                extension = ImageStore.__type_extension(content_type)
+                            if extension is None:
+                                logger.error(f"Image <{image_link}> dropped, content is not an image")
+                                return None
+                        size += len(chunk)
+                        if size > ImageStore.max_size:
+                            logger.error(f"Image <{image_link}> dropped, size exceed {ImageStore.max_size} bytes")
+                            return None
+                        hash_code.update(chunk)
+                        image.write(chunk)
+            if size == 0:
+                return None
+            Metrics.inc('image_bytes_total', size)
+            path = ImageStore.__path(hash_code.hexdigest(), extension)
+            if os.path.exists(path):
+                logger.info(f"Image <{image_link}> exist in the store")
+                Metrics.inc('images_total', result='exist')
+            else:
+                Metrics.inc('images_total', result='saved')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            return os.path.abspath(path).replace('\\', '/')
+        except httpx.HTTPError as e:
+            logger.error(f"Image link:<{image_link}> not added Exception : {e}")
+            return None
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    async def save_all(news: list[dict]):
+        """
+        Save the images of a list of news in the same time, the path of the image saved in the key `media_path`
+        :param news: list of news
+        """
+        news_with_media = [item for item in news if item.get('media') and item.get('media') != 'Nothings']
+        paths = await asyncio.gather(*[ImageStore.save(item['media']) for item in news_with_media])
+        for item, path in zip(news_with_media, paths):
+            item['media_path'] = path
+        logger.info(f"{sum(1 for path in paths if path)}/{len(news_with_media)} images saved")
@@ -0,0 +1,62 @@
+import math
+from hashlib import blake2b
+from typing import Iterable
+import logging
+import src.logging_config
+
+logger = logging.getLogger("LinkIndex")
+
+
+class BloomFilter:
+    """
+    Set of strings with fixed size in memory. A string added is always found, a string not added can be found
+    with probability `error_rate` (when the filter hold `capacity` strings), so a found string need an exact check.
+    """
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.number_of_hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def __positions(self, item: str):
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return [(first + i * second) % self.size for i in range(self.number_of_hashes)]
+
+    def add(self, item: str):
+        for position in self.__positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(item))
+
+
+class LinkIndex:
+    """
+    Index of the links of news saved in the database, it answers quickly if a link is new. The links found in the
+    filter are only 'maybe saved', `ManageDB.filter_new_links` check them in the database.
+    """
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.01):
+        self.error_rate = error_rate
+        self.bloom = BloomFilter(capacity, error_rate)
+
+    def load(self, links: Iterable[str], number_of_links: int = 0):
+        """
+        Build the index from the links saved, the filter capacity grow with the number of links
+        :param links: iterable of the links saved in the database
+        :param number_of_links: how much links in the database
+        """
+        if number_of_links * 2 > self.bloom.capacity:
+            self.bloom = BloomFilter(number_of_links * 2, self.error_rate)
+        for link in links:
+            self.bloom.add(link)
+        logger.info(f"Link index loaded with {self.bloom.count} links ({len(self.bloom.bits)} bytes)")
+
+    def add(self, link: str):
+        self.bloom.add(link)
+
+    def maybe_saved(self, link: str) -> bool:
+        return link in self.bloom
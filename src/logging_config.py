@@ -1,5 +1,21 @@
+import atexit
 import logging.config
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from os import environ
+from dotenv import load_dotenv
 from pythonjsonlogger import jsonlogger
+
+# The logging is configured by the environment (or the .env file):
+#   LOG_LEVEL         level of the root logger, default INFO
+#   LOG_LEVELS        level of some loggers, like "Cleaner=WARNING,httpx=WARNING"
+#   LOG_QUEUE         1 (default) the records are formatted and written by a background thread, 0 written directly
+#   LOG_RATE_LIMIT    "100/10": the same log line (DEBUG, INFO) is written at most 100 times in 10 seconds, 0 no limit
+#   LOG_MAX_BYTES     size of the log file before the rotation, default 20MB
+#   LOG_BACKUP_COUNT  number of old log files kept, default 5
+load_dotenv('./.env')
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -19,12 +35,78 @@ LOGGING = {
             'class': 'logging.handlers.RotatingFileHandler',
             'formatter': 'json',
             'filename': 'logs/app.log',
-            'maxBytes': 1024 * 1024,  # 1MB
-            'backupCount': 3,  # Keep 3 backup files
+            'maxBytes': int(environ.get('LOG_MAX_BYTES', 20 * 1024 * 1024)),  # 20MB
+            'backupCount': int(environ.get('LOG_BACKUP_COUNT', 5)),  # Keep 5 backup files
         },
     },
-    "loggers": {"": {"handlers": ["stdout", "rotating_file_handler"], "level": "DEBUG"}},
+    "loggers": {
+        "": {"handlers": ["stdout", "rotating_file_handler"], "level": environ.get('LOG_LEVEL', 'INFO').upper()},
+        **{name.strip(): {"level": level.strip().upper()} for name, _, level in
+           (item.partition('=') for item in environ.get('LOG_LEVELS', '').split(',') if '=' in item)},
+    },
 }
 
 
+class RateLimitFilter(logging.Filter):
+    """
+    Drop the repetitive records: a log line (same logger, file and line) is kept `limit` times every `interval`
+    seconds, the others are dropped and their number is added to the next record kept, in the field `suppressed`.
+    The records of level WARNING and more are always kept.
+    """
+    def __init__(self, limit: int = 20, interval: float = 10, level: int = logging.WARNING):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.level = level
+        # {(logger, file, line): [start of the window, records kept, records dropped]}
+        self.windows: dict[tuple, list] = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.level:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or record.created - window[0] >= self.interval:
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                self.windows[key] = [record.created, 1, 0]
+                return True
+            if window[1] < self.limit:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+def rate_limit_filter(setting: str):
+    """:return: the filter of the setting "limit/interval", None if no limit"""
+    limit, _, interval = setting.partition('/')
+    if not limit or int(limit) <= 0:
+        return None
+    return RateLimitFilter(int(limit), float(interval or 10))
+
+
+def start_queue(root: logging.Logger) -> QueueListener:
+    """
+    The handlers of the root logger are moved to a background thread: the code only puts the records in a queue, the
+    JSON formatting and the writing to stdout and to the file are done by the thread.
+    """
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, *root.handlers, respect_handler_level=True)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(records))
+    listener.start()
+    # the records waiting are written before the end of the program
+    atexit.register(listener.stop)
+    return listener
+
+
 logging.config.dictConfig(LOGGING)
+listener = start_queue(logging.getLogger()) if environ.get('LOG_QUEUE', '1') != '0' else None
+for root_handler in logging.getLogger().handlers:
+    rate_limit = rate_limit_filter(environ.get('LOG_RATE_LIMIT', '100/10'))
+    if rate_limit is not None:
+        root_handler.addFilter(rate_limit)
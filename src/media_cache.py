@@ -0,0 +1,87 @@
+import heapq
+import time
+import logging
+import src.logging_config
+from src.buffering import JournalBuffer
+
+logger = logging.getLogger("MediaCache")
+
+
+class MediaCache:
+    """
+    The image found for every article, so an article is requested one time to get its image. The articles without image
+    are saved also (media None) for a shorter time. Every item is appended to the journal `files/media_cache.jsonl`.
+    Item: {'link': article url, 'media': image url or None, 'expires': timestamp}
+    """
+    # Time in seconds an image found is used, and the time an article without image is not requested again
+    ttl = 30 * 86400
+    negative_ttl = 86400
+    items: dict[str, dict] = {}
+    expirations: list[tuple[float, str]] = []
+    journal: JournalBuffer = None
+    # {'hits': images found in the cache, 'misses': articles not in the cache}
+    stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def load(journal: JournalBuffer):
+        """
+        Load the items of the journal, the last line of every link is its state
+        :param journal: the journal of the cache
+        """
+        MediaCache.journal = journal
+        MediaCache.items = {}
+        MediaCache.expirations = []
+        for item in journal.iter_items():
+            MediaCache.__put(item)
+        MediaCache.evict()
+        logger.info(f"{len(MediaCache.items)} articles in the media cache")
+
+    @staticmethod
+    def __put(item: dict):
+        MediaCache.items[item['link']] = item
+        heapq.heappush(MediaCache.expirations, (item['expires'], item['link']))
+
+    @staticmethod
+    def evict():
+        """Remove the expired items, ordered by expiration time"""
+        now = time.time()
+        while MediaCache.expirations:
+            expires, link = MediaCache.expirations[0]
+            item = MediaCache.items.get(link)
+            if item is not None and item['expires'] == expires and expires > now:
+                break
+            heapq.heappop(MediaCache.expirations)
+            # the item not replaced by a new one
+            if item is not None and item['expires'] == expires:
+                del MediaCache.items[link]
+
+    @staticmethod
+    def get(link: str):
+        """
+        :param link: the URL of the article
+        :return: tuple (found, media), found is False if the article is not in the cache or expired, media is None when
+        the article has no image
+        """
+        item = MediaCache.items.get(link)
+        if item is None or item['expires'] <= time.time():
+            MediaCache.stats['misses'] += 1
+            return False, None
+        MediaCache.stats['hits'] += 1
+        return True, item['media']
+
+    @staticmethod
+    def put(link: str, media: str = None):
+        """
+        Save the image of the article
+        :param link: the URL of the article
+        :param media: the URL of the image, None if the article has no image
+        """
+        item = {
+            'link': link,
+            'media': media,
+            'expires': time.time() + (MediaCache.ttl if media else MediaCache.negative_ttl),
+        }
+        MediaCache.__put(item)
+        if MediaCache.journal:
+            MediaCache.journal.add_item(item)
+        MediaCache.evict()
@@ -0,0 +1,70 @@
+from urllib import parse
+from lxml import etree
+
+
+class MediaExtractor:
+    """
+    Find the image of an article while its HTML is downloaded. The HTML is given by chunks to an incremental parser, the
+    image is found in the first of: `og:image`, `twitter:image`, `<link rel="image_src">` or the first content `<img>`.
+    So the download is stopped when the image is found, generally in the `<head>` of the page.
+    """
+    meta_names = {'og:image', 'og:image:url', 'og:image:secure_url', 'twitter:image', 'twitter:image:src'}
+    # images that are not the image of the article: tracking pixels, inline images
+    skipped_sizes = {'0', '1'}
+
+    def __init__(self, base_url: str):
+        """:param base_url: used to join the relative link of the image"""
+        self.base_url = base_url
+        self.parser = etree.HTMLPullParser(events=('start',))
+        self.bytes_read = 0
+        self.media = None
+
+    def feed(self, chunk: bytes):
+        """
+        Parse the next chunk of the HTML
+        :return: the URL of the image if found, else None
+        """
+        if self.media is not None:
+            return self.media
+        self.bytes_read += len(chunk)
+        self.parser.feed(chunk)
+        for _, element in self.parser.read_events():
+            link = self.__element_media(element)
+            if link:
+                self.media = parse.urljoin(self.base_url, link.strip())
+                return self.media
+        return None
+
+    def close(self):
+        """The HTML is finished, :return: the URL of the image, None if the article has no image"""
+        if self.media is None:
+            try:
+                self.parser.close()
+            except etree.XMLSyntaxError:
+                pass
+            for _, element in self.parser.read_events():
+                link = self.__element_media(element)
+                if link:
+                    self.media = parse.urljoin(self.base_url, link.strip())
+                    break
+        return self.media
+
+    @staticmethod
+    def __element_media(element):
+        tag = element.tag if isinstance(element.tag, str) else ''
+        if tag == 'meta':
+            name = (element.get('property') or element.get('name') or '').strip().lower()
+            if name in MediaExtractor.meta_names:
+                return element.get('content')
+        elif tag == 'link':
+            if 'image_src' in (element.get('rel') or '').lower().split():
+                return element.get('href')
+        elif tag == 'img':
+            src = element.get('src')
+            if not src or src.startswith('data:'):
+                return None
+            if element.get('width') in MediaExtractor.skipped_sizes or \
+                    element.get('height') in MediaExtractor.skipped_sizes:
+                return None
+            return src
+        return None
@@ -0,0 +1,261 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+import logging
+import src.logging_config
+
+logger = logging.getLogger("Metrics")
+
+# (trace id, span id) of the code running, the trace is the journey of one channel through the pipeline
+current_span: ContextVar[tuple] = ContextVar('current_span', default=None)
+# returned by the timers and the spans when the metrics are disabled
+NOOP = nullcontext()
+
+
+class Timer:
+    """Observe the time of the block in a histogram, and count the blocks running in a gauge"""
+    __slots__ = ('name', 'gauge', 'labels', 'started')
+
+    def __init__(self, name: str, gauge: str = None, labels: dict = None):
+        self.name = name
+        self.gauge = gauge
+        self.labels = labels
+
+    def __enter__(self):
+        if self.gauge:
+            Metrics.add(self.gauge, 1, **self.labels)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        Metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        if self.gauge:
+            Metrics.add(self.gauge, -1, **self.labels)
+
+
+class Span:
+    """A step of a trace, the logs written in the block have the trace id and the span id"""
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'token', 'started')
+
+    def __init__(self, name: str, trace_id: str = None):
+        parent = current_span.get()
+        self.name = name
+        self.trace_id = trace_id or (parent[0] if parent else Metrics.new_trace())
+        self.parent_id = parent[1] if parent and parent[0] == self.trace_id else None
+        self.span_id = os.urandom(4).hex()
+
+    def __enter__(self):
+        self.token = current_span.set((self.trace_id, self.span_id))
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started
+        current_span.reset(self.token)
+        logger.debug(f"Span {self.name} of trace {self.trace_id} took {seconds:.4f}s", extra={
+            'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id, 'span': self.name,
+            'seconds': round(seconds, 6)})
+
+
+class TraceFilter(logging.Filter):
+    """Add the trace id and the span id of the code running to the log records"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = current_span.get()
+        if span is not None and not hasattr(record, 'trace_id'):
+            record.trace_id, record.span_id = span
+        return True
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of the run, saved in memory and exported in the Prometheus text format to a file
+    (read by the textfile collector of node_exporter), with a summary table at the end of the run.
+    The metrics are disabled by default: every function returns directly, so the cost in the program is only a call.
+    A metric is identified by its name and its labels: Metrics.observe('fetch_seconds', 0.2, host='example.com')
+    """
+    enabled = False
+    prefix = 'scrape_news_'
+    # upper bounds of the histograms in seconds
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    # {name: {labels: value}}, labels is a sorted tuple of (label, value)
+    counters: dict[str, dict[tuple, float]] = {}
+    gauges: dict[str, dict[tuple, float]] = {}
+    # {name: {labels: [count of every bucket..., count of +Inf, sum]}}
+    histograms: dict[str, dict[tuple, list]] = {}
+    # the database writer thread updates the metrics too
+    lock = threading.Lock()
+    export_path: str = None
+    # seconds between two exports in daemon mode
+    export_interval = 15
+
+    @staticmethod
+    def enable(export_path: str = None):
+        """
+        Start collecting the metrics, and add the trace ids to the logs
+        :param export_path: the Prometheus file written by `Metrics.export`, None to only have the summary
+        """
+        Metrics.enabled = True
+        Metrics.export_path = export_path
+        for handler in logging.getLogger().handlers:
+            if not any(isinstance(filter_, TraceFilter) for filter_ in handler.filters):
+                handler.addFilter(TraceFilter())
+        logger.info(f"Metrics enabled (export to {export_path})")
+
+    @staticmethod
+    def reset():
+        with Metrics.lock:
+            Metrics.counters = {}
+            Metrics.gauges = {}
+            Metrics.histograms = {}
+
+    @staticmethod
+    def inc(name: str, value: float = 1, **labels):
+        """Increment a counter"""
+        if not Metrics.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with Metrics.lock:
+            values = Metrics.counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    @staticmethod
+    def add(name: str, value: float, **labels):
+        """Add a value (negative to remove) to a gauge, like the requests in flight"""
+        if not Metrics.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with Metrics.lock:
+            values = Metrics.gauges.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    @staticmethod
+    def set(name: str, value: float, **labels):
+        """Set the value of a gauge, like the size of a queue"""
+        if not Metrics.enabled:
+            return
+        with Metrics.lock:
+            Metrics.gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    @staticmethod
+    def observe(name: str, value: float, **labels):
+        """Add a value to a histogram"""
+        if not Metrics.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with Metrics.lock:
+            values = Metrics.histograms.setdefault(name, {})
+            counts = values.get(key)
+            if counts is None:
+                counts = values[key] = [0] * (len(Metrics.buckets) + 2)
+            counts[bisect.bisect_left(Metrics.buckets, value)] += 1
+            counts[-1] += value
+
+    @staticmethod
+    def timer(name: str, gauge: str = None, **labels):
+        """
+        Context manager that observe the time of the block in the histogram `name`, used with `with`
+        :param gauge: name of a gauge of the blocks running (in flight), with the same labels
+        """
+        if not Metrics.enabled:
+            return NOOP
+        return Timer(name, gauge, labels)
+
+    @staticmethod
+    def new_trace() -> str:
+        """:return: the id of a new trace, None if the metrics are disabled"""
+        return os.urandom(8).hex() if Metrics.enabled else None
+
+    @staticmethod
+    def span(name: str, trace_id: str = None):
+        """
+        Context manager of a step of a trace, the code called in the block (and the tasks created by it) is in the span
+        :param name: name of the step, its time is written in a debug log with the ids
+        :param trace_id: the trace of the step, default the trace of the code running or a new trace
+        """
+        if not Metrics.enabled:
+            return NOOP
+        return Span(name, trace_id)
+
+    @staticmethod
+    def __format_number(value: float) -> str:
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+    @staticmethod
+    def __format_labels(labels: tuple, extra: tuple = ()) -> str:
+        labels = labels + extra
+        if not labels:
+            return ''
+        values = ','.join(
+            f'{label}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+            for label, value in labels)
+        return '{' + values + '}'
+
+    @staticmethod
+    def prometheus() -> str:
+        """:return: all the metrics in the Prometheus text format"""
+        lines = []
+        with Metrics.lock:
+            for kind, metrics in (('counter', Metrics.counters), ('gauge', Metrics.gauges)):
+                for name, values in sorted(metrics.items()):
+                    lines.append(f"# TYPE {Metrics.prefix}{name} {kind}")
+                    lines += [f"{Metrics.prefix}{name}{Metrics.__format_labels(labels)} {Metrics.__format_number(value)}"
+                              for labels, value in values.items()]
+            for name, values in sorted(Metrics.histograms.items()):
+                name = Metrics.prefix + name
+                lines.append(f"# TYPE {name} histogram")
+                for labels, counts in values.items():
+                    cumulative = 0
+                    for bound, count in zip(Metrics.buckets + ('+Inf',), counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{Metrics.__format_labels(labels, (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{Metrics.__format_labels(labels)} {Metrics.__format_number(counts[-1])}")
+                    lines.append(f"{name}_count{Metrics.__format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def export(path: str = None):
+        """Write the metrics in the Prometheus file, replaced in one time so the collector never reads half a file"""
+        path = path or Metrics.export_path
+        if not Metrics.enabled or not path:
+            return
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(Metrics.prometheus())
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def __quantile(counts: list, quantile: float) -> float:
+        """Estimate of the quantile from the buckets, the upper bound of the bucket where it is"""
+        total = sum(counts[:-1])
+        rank = quantile * total
+        cumulative = 0
+        for bound, count in zip(Metrics.buckets, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+    @staticmethod
+    def summary() -> str:
+        """:return: table of the histograms and the counters of the run"""
+        rows = []
+        with Metrics.lock:
+            for name, values in sorted(Metrics.histograms.items()):
+                for labels, counts in sorted(values.items()):
+                    count = sum(counts[:-1])
+                    rows.append((f"{name}{Metrics.__format_labels(labels)}", f"{count}", f"{counts[-1]:.3f}",
+                                 f"{counts[-1] / count * 1000:.1f}" if count else '-',
+                                 f"<={Metrics.__quantile(counts, 0.5) * 1000:g}",
+                                 f"<={Metrics.__quantile(counts, 0.95) * 1000:g}"))
+            counters = [(f"{name}{Metrics.__format_labels(labels)}", Metrics.__format_number(value))
+                        for name, values in sorted(Metrics.counters.items()) for labels, value in sorted(values.items())]
+        width = max([len(row[0]) for row in rows + counters] + [6])
+        lines = [f"{'metric':<{width}} {'count':>8} {'total s':>10} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10}"]
+        lines += [f"{row[0]:<{width}} {row[1]:>8} {row[2]:>10} {row[3]:>10} {row[4]:>10} {row[5]:>10}" for row in rows]
+        if counters:
+            lines.append('')
+            lines += [f"{name:<{width}} {value:>8}" for name, value in counters]
+        return '\n'.join(lines)
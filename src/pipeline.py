@@ -0,0 +1,242 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+import logging
+import src.logging_config
+from src.scraper import Scraper
+from src.cleaner import Cleaner
+from src.handle_errors import ErrorHandler
+from src.database_manager import ManageDB
+from src.channel_registry import ChannelRegistry
+from src.retry_queue import RetryQueue
+from src.media_cache import MediaCache
+from src.feed_profile import FeedProfile
+from src.metrics import Metrics
+
+logger = logging.getLogger("Pipeline")
+
+
+class Pipeline:
+    """
+    The run of the channels in stages: fetch -> parse -> dedup -> clean -> media -> images -> save. Every stage has its
+    workers and a bounded queue before it, a stage that is slow makes the stages before it wait (backpressure), so the
+    feeds in memory are limited by the size of the queues and not by the number of channels.
+    A job is a dict object {'name': channel name, 'parser': parser of the feed, 'trace': trace id of the job (None if the
+    metrics are disabled), 'data': the data of the Scraper}, the data is completed stage by stage. Every stage of a job
+    is a span of its trace.
+    """
+    stages = ('fetch', 'parse', 'dedup', 'clean', 'media', 'images', 'save')
+    # number of workers of every stage
+    workers = {
+        'fetch': 32,
+        'parse': 2,
+        'dedup': 2,
+        'clean': 2,
+        'media': 8,
+        'images': 4,
+        'save': 1,
+    }
+    # number of jobs waiting before every stage
+    queue_size = 16
+    # the feeds with this number of items or less (usual number of their profile) are parsed without a thread
+    inline_parse_items = 30
+
+    def __init__(self, channels: dict, on_done: Callable[[str, dict], Awaitable] = None, workers: dict = None,
+                 queue_size: int = None, seen_links=None, on_failed: Callable[[dict], Awaitable] = None):
+        """
+        :param channels: the channels dictionary, name -> {'base_url', 'rss_url', 'language'}
+        :param on_done: coroutine function called when the job of a channel is finished, with the name of the channel
+        and the data of the Scraper (None if the feed not modified or not reached)
+        :param workers: number of workers of some stages, the others use `Pipeline.workers`
+        :param queue_size: size of the queues, default `Pipeline.queue_size`
+        :param seen_links: the links set shared with other processes (`WorkQueue`), the news in it are saved by another
+        process and skipped, the links of the news saved are added to it. None when the pipeline is the only one saving
+        news.
+        :param on_failed: coroutine function called with the result of the Scraper when the feed is not reached, default
+        `ErrorHandler.not_handled_websites` (the retry queue of the process)
+        """
+        self.channels = channels
+        self.on_done = on_done
+        self.workers = {**Pipeline.workers, **(workers or {})}
+        self.queue_size = queue_size or Pipeline.queue_size
+        self.seen_links = seen_links
+        self.on_failed = on_failed or ErrorHandler.not_handled_websites
+        self.handlers = {stage: getattr(self, f"_Pipeline__{stage}") for stage in Pipeline.stages}
+        self.queues: dict[str, asyncio.Queue] = {}
+        self.tasks: list[asyncio.Task] = []
+        # {stage: {'jobs': number of jobs handled, 'seconds': time spent by the workers}}
+        self.stats = {stage: {'jobs': 0, 'seconds': 0.0} for stage in Pipeline.stages}
+
+    def start(self):
+        self.queues = {stage: asyncio.Queue(self.queue_size) for stage in Pipeline.stages}
+        for stage in Pipeline.stages:
+            for _ in range(self.workers[stage]):
+                self.tasks.append(asyncio.create_task(self.__work(stage)))
+        logger.info(f"Pipeline started with workers {self.workers}")
+
+    async def submit(self, name: str):
+        """Add a channel to the pipeline, wait if the queue of the first stage is full"""
+        channel = self.channels[name]
+        await self.queues['fetch'].put({
+            'name': name,
+            'parser': channel.get('parser', 'lxml'),
+            'trace': Metrics.new_trace(),
+            'data': {'channel_url': channel['base_url'], 'work_on': channel['rss_url']},
+        })
+
+    async def close(self):
+        """Wait all the jobs submitted to finish, then stop the workers"""
+        # a job is put in the next queue before its stage mark it done, so the stages are waited in order
+        for stage in Pipeline.stages:
+            if stage in self.queues:
+                await self.queues[stage].join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        logger.info("Pipeline stopped, " + ", ".join(
+            f"{stage}: {stats['jobs']} jobs in {stats['seconds']:.2f}s" for stage, stats in self.stats.items()))
+        logger.info(f"Images of {MediaCache.stats['hits']} articles found in the cache, "
+                    f"{Scraper.media_stats['articles']} articles searched, "
+                    f"{Scraper.media_stats['bytes_read']} bytes read and {Scraper.media_stats['bytes_saved']} bytes "
+                    f"not downloaded")
+
+    async def __work(self, stage: str):
+        queue = self.queues[stage]
+        next_stage = Pipeline.stages[Pipeline.stages.index(stage) + 1] if stage != Pipeline.stages[-1] else None
+        while True:
+            job = await queue.get()
+            Metrics.set('queue_jobs', queue.qsize(), stage=stage)
+            started = time.perf_counter()
+            try:
+                with Metrics.span(stage, job['trace']), Metrics.timer('stage_seconds', 'stage_in_flight', stage=stage):
+                    handled = await self.handlers[stage](job)
+                # the wait of a full queue is not in `stage_seconds`
+                if handled is not None and next_stage is not None:
+                    await self.queues[next_stage].put(handled)
+            except Exception as e:
+                logger.error(f"Exception in stage {stage} of {job['name']}: {e}", exc_info=True)
+                Metrics.inc('stage_errors_total', stage=stage)
+                await self.__finish(job, None)
+            finally:
+                self.stats[stage]['jobs'] += 1
+                self.stats[stage]['seconds'] += time.perf_counter() - started
+                queue.task_done()
+
+    async def __finish(self, job: dict, data: dict = None):
+        """Call `on_done` one time by job, its exceptions are logged and do not fail the stage"""
+        if self.on_done is None or job.get('finished'):
+            return
+        job['finished'] = True
+        try:
+            await self.on_done(job['name'], data)
+        except Exception as e:
+            logger.error(f"Exception in on_done of {job['name']}: {e}", exc_info=True)
+
+    async def __fetch(self, job: dict):
+        data = job['data']
+        result = await Scraper.fetch_feed((data['channel_url'], data['work_on']))
+        if result['status']:
+            job['data'] = result['data']
+            return job
+        error = result['data']['error']
+        if error == 304:
+            logger.info(f"Nothing new in {data['work_on']}")
+            RetryQueue.done(data['work_on'])
+        elif error == 403:
+            content, access = await ErrorHandler.get_protected_content(data['work_on'])
+            if content:
+                # the next polls go directly to the way that worked
+                FeedProfile.update(data['work_on'], access=access)
+                job['data'] = {**result['data'], 'content': content}
+                del job['data']['error']
+                return job
+            await self.on_failed(result)
+        else:
+            await self.on_failed(result)
+        await self.__finish(job, None)
+        return None
+
+    async def __parse(self, job: dict):
+        data = job['data']
+        # a small feed is parsed quicker than its hand-off to a thread, the unknown feeds are parsed in a thread
+        item_count = FeedProfile.get(data['work_on']).get('item_count')
+        inline = item_count is not None and item_count <= self.inline_parse_items
+        # the content is not needed after the parsing
+        with Metrics.timer('parse_seconds', feed=job['name']):
+            if inline:
+                rss_feed = Scraper.parse_feed(data.pop('content'), job['parser'])
+            else:
+                rss_feed = await asyncio.to_thread(Scraper.parse_feed, data.pop('content'), job['parser'])
+        FeedProfile.update_item_count(data['work_on'], len(rss_feed.entries))
+        data['entries'] = rss_feed.entries
+        data['poll_hints'] = Scraper.get_poll_hints(rss_feed)
+        return job
+
+    async def __dedup(self, job: dict):
+        data = job['data']
+        entries = data['entries']
+        data['entries'] = await Scraper.drop_saved_entries(entries, data['work_on'])
+        if self.seen_links is not None and data['entries']:
+            # the news saved by another worker since its start, not in the link index of this process
+            unseen = await self.seen_links.unseen_links([entry.link for entry in data['entries']])
+            data['entries'] = [entry for entry in data['entries'] if entry.link in unseen]
+        data['number_of_news'] = len(data['entries'])
+        data['number_of_skipped'] = len(entries) - len(data['entries'])
+        if not data['entries']:
+            await self.__save_feed(data)
+            await self.__finish(job, data)
+            return None
+        return job
+
+    async def __clean(self, job: dict):
+        data = job['data']
+        # the news are cleaned before getting the images from the articles, no request for the garbage news
+        with Metrics.timer('clean_seconds', feed=job['name']):
+            data['news'] = [
+                Scraper.build_news(entry, Scraper.feed_media(entry, data['channel_url'], data['work_on']),
+                                   data['work_on'])
+                for entry in data.pop('entries')
+            ]
+            data['news'], garbage = await Cleaner.partition_news(data)
+        Metrics.inc('news_cleaned_total', len(data['news']), feed=job['name'])
+        Metrics.inc('news_garbage_total', len(garbage), feed=job['name'])
+        await Cleaner.save_no_cleaned_news(garbage)
+        return job
+
+    async def __media(self, job: dict):
+        data = job['data']
+        news_without_media = [news for news in data['news'] if news['media'] == "Nothings"]
+        medias = await asyncio.gather(
+            *[Scraper.article_media(news['link'], data['channel_url'], data['work_on']) for news in news_without_media])
+        for news, media in zip(news_without_media, medias):
+            news['media'] = Cleaner.clean_media(media)
+        return job
+
+    async def __images(self, job: dict):
+        await Scraper.save_images(job['data']['news'])
+        return job
+
+    async def __save(self, job: dict):
+        data = job['data']
+        channel = ChannelRegistry.find_by_rss_url(data['work_on'])
+        if channel is None:
+            logger.error(f"No channel has RSS url {data['work_on']}")
+        else:
+            saved = await ManageDB.save_news({'status': True, 'data': data}, channel)
+            # Update channel news number, saved to the database by the registry flush
+            ChannelRegistry.add_news(channel, saved['inserted'])
+            Metrics.inc('news_saved_total', saved['inserted'], feed=job['name'])
+            if self.seen_links is not None:
+                # only the news inserted, so a worker failed before the saving does not hide news to the others
+                await self.seen_links.add_links(saved['links'])
+            await self.__save_feed(data)
+        data.pop('news', None)
+        await self.__finish(job, data)
+        return None
+
+    @staticmethod
+    async def __save_feed(data: dict):
+        """The feed is handled, next run request it with its validators"""
+        await Scraper.save_validators(data['work_on'], data.get('validators'))
+        RetryQueue.done(data['work_on'])
@@ -0,0 +1,102 @@
+import asyncio
+import random
+import time
+import httpx
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+import logging
+import src.logging_config
+
+logger = logging.getLogger("Retry")
+
+
+class Retry:
+    """
+    Retry the requests failed by a server error (5xx, 429) or a transport error (connexion, timeout), without blocking
+    the event loop. The delay grow exponentially with random jitter, and respect the header `Retry-After`.
+    The number of retries of a run is limited by `Retry.budget`, so a lot of websites down do not make the run longer.
+    """
+    retry_statuses = {429, 500, 502, 503, 504}
+    max_attempts = 3
+    base_delay = 1
+    max_delay = 30
+    # if the server ask to wait more than this, the request is not retried
+    max_retry_after = 120
+    budget = 500
+    used_budget = 0
+
+    @staticmethod
+    def reset_budget():
+        """Called at the start of every run"""
+        Retry.used_budget = 0
+
+    @staticmethod
+    def retry_after(response: httpx.Response):
+        """
+        Read the header `Retry-After`, it can be a number of seconds or a date
+        :return: the delay in seconds, None if the header not exist
+        """
+        value = response.headers.get('retry-after')
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def next_delay(attempt: int, response: httpx.Response = None, max_attempts: int = None, base_delay: float = None):
+        """
+        Calculate the delay before the next attempt, full jitter: random delay between 0 and base_delay * 2**attempt
+        :param attempt: number of the attempts failed - 1
+        :param response: the response failed, None if transport error
+        :param max_attempts: number of retries of this request
+        :param base_delay: delay of the first retry
+        :return: the delay in seconds, None if the request must not be retried
+        """
+        max_attempts = Retry.max_attempts if max_attempts is None else max_attempts
+        base_delay = Retry.base_delay if base_delay is None else base_delay
+        if attempt >= max_attempts or Retry.used_budget >= Retry.budget:
+            return None
+        delay = random.uniform(0, min(Retry.max_delay, base_delay * 2 ** attempt))
+        if response is not None:
+            retry_after = Retry.retry_after(response)
+            if retry_after is not None:
+                if retry_after > Retry.max_retry_after:
+                    return None
+                delay = max(delay, retry_after)
+        Retry.used_budget += 1
+        return delay
+
+    @staticmethod
+    async def call(send: Callable[[], Awaitable[httpx.Response]], url: str, max_attempts: int = None,
+                   base_delay: float = None) -> httpx.Response:
+        """
+        Send the request and retry it if failed
+        :param send: coroutine function that send the request and returns the response
+        :param url: the URL requested, used in the logs
+        :param max_attempts: number of retries of this request
+        :param base_delay: delay of the first retry
+        :return: the last response, the transport error raised if no response
+        """
+        attempt = 0
+        while True:
+            try:
+                response = await send()
+            except httpx.TransportError as e:
+                delay = Retry.next_delay(attempt, None, max_attempts, base_delay)
+                if delay is None:
+                    raise
+                logger.info(f"Retry <{url}> after {delay:.2f}s, exception: {e!r}")
+            else:
+                if response.status_code not in Retry.retry_statuses:
+                    return response
+                delay = Retry.next_delay(attempt, response, max_attempts, base_delay)
+                if delay is None:
+                    return response
+                logger.info(f"Retry <{url}> after {delay:.2f}s, status code <{response.status_code}>")
+            await asyncio.sleep(delay)
+            attempt += 1
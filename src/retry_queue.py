@@ -0,0 +1,98 @@
+import heapq
+import time
+import logging
+import src.logging_config
+from src.buffering import JournalBuffer
+
+logger = logging.getLogger("RetryQueue")
+
+
+class RetryQueue:
+    """
+    Durable queue of the feeds not handled, ordered by the time of their next try. A feed is in the queue one time,
+    every new failure double its delay. Every change is appended to the journal `files/not_handled_urls.jsonl`.
+    Item: {'url': rss url, 'error': status code, 'time_of_fail': timestamp, 'due': timestamp, 'failures': number}
+    """
+    max_delay = 24 * 3600
+    items: dict[str, dict] = {}
+    queue: list[tuple[float, str]] = []
+    journal: JournalBuffer = None
+
+    @staticmethod
+    def load(journal: JournalBuffer):
+        """
+        Load the items of the journal, the last line of every URL is its state
+        :param journal: the journal of the queue
+        """
+        RetryQueue.journal = journal
+        RetryQueue.items = {}
+        for item in journal.iter_items():
+            if item.get('done'):
+                RetryQueue.items.pop(item['url'], None)
+            else:
+                RetryQueue.items[item['url']] = item
+        RetryQueue.queue = [(item['due'], url) for url, item in RetryQueue.items.items()]
+        heapq.heapify(RetryQueue.queue)
+        logger.info(f"{len(RetryQueue.items)} feeds in the retry queue")
+
+    @staticmethod
+    def push(url: str, error: int, time_of_fail: float, after: float):
+        """
+        Add a feed failed to the queue, if it is already in the queue its delay is doubled
+        :param url: the URL of the RSS feed
+        :param error: the status code of the failure
+        :param time_of_fail: timestamp of the failure
+        :param after: delay of the first try
+        :return: the item of the feed
+        """
+        previous = RetryQueue.items.get(url)
+        failures = previous['failures'] + 1 if previous else 1
+        delay = min(after * 2 ** (failures - 1), RetryQueue.max_delay)
+        item = {
+            'url': url,
+            'error': error,
+            'time_of_fail': time_of_fail,
+            'due': time.time() + delay,
+            'failures': failures,
+        }
+        RetryQueue.items[url] = item
+        heapq.heappush(RetryQueue.queue, (item['due'], url))
+        if RetryQueue.journal:
+            RetryQueue.journal.add_item(item)
+        return item
+
+    @staticmethod
+    def done(url: str):
+        """The feed is handled, remove it from the queue"""
+        if RetryQueue.items.pop(url, None) is None:
+            return
+        if RetryQueue.journal:
+            RetryQueue.journal.add_item({'url': url, 'done': True})
+        logger.info(f"{url} handled, removed from the retry queue")
+
+    @staticmethod
+    def pop_due() -> list[dict]:
+        """
+        :return: the items which their time is reached, they stay in the queue until `done` or pushed again
+        """
+        now = time.time()
+        items = []
+        while RetryQueue.queue and RetryQueue.queue[0][0] <= now:
+            due, url = heapq.heappop(RetryQueue.queue)
+            item = RetryQueue.items.get(url)
+            # an old entry, the feed was pushed again or done
+            if item is None or item['due'] != due:
+                continue
+            items.append(item)
+        return items
+
+    @staticmethod
+    def next_due():
+        """:return: timestamp of the next item, None if the queue is empty"""
+        while RetryQueue.queue:
+            due, url = RetryQueue.queue[0]
+            item = RetryQueue.items.get(url)
+            if item is not None and item['due'] == due:
+                return due
+            heapq.heappop(RetryQueue.queue)
+        return None
@@ -0,0 +1,132 @@
+import asyncio
+import heapq
+import time
+import logging
+import src.logging_config
+
+logger = logging.getLogger("Scheduler")
+
+
+class Scheduler:
+    """
+    Priority queue of the channels ordered by the time of their next poll. Every channel has its own interval, adapted
+    after every poll to how much the feed publish: a busy channel polled often, a sleepy one rarely.
+    """
+    default_interval = 900
+    min_interval = 120
+    max_interval = 6 * 3600
+    # weight of the last poll in the new interval
+    smoothing = 0.5
+    # when nothing new the interval grow by this factor
+    backoff_factor = 1.5
+    # number of new news wanted in every poll
+    target_new_news = 2
+    update_periods = {
+        'hourly': 3600,
+        'daily': 86400,
+        'weekly': 7 * 86400,
+        'monthly': 30 * 86400,
+        'yearly': 365 * 86400,
+    }
+    queue: list[tuple[float, str]] = []
+    intervals: dict[str, float] = {}
+    # minimum interval asked by the feed, kept for the polls without feed (not modified)
+    hinted_intervals: dict[str, float] = {}
+    due_times: dict[str, float] = {}
+    changed: asyncio.Event = None
+
+    @staticmethod
+    def schedule(name: str, due: float = None):
+        """
+        Schedule the next poll of the channel
+        :param name: channel name
+        :param due: timestamp of the poll, default after the interval of the channel
+        """
+        if due is None:
+            due = time.time() + Scheduler.intervals.get(name, Scheduler.default_interval)
+        Scheduler.due_times[name] = due
+        heapq.heappush(Scheduler.queue, (due, name))
+        if Scheduler.changed is not None:
+            Scheduler.changed.set()
+
+    @staticmethod
+    def pop_due() -> list[str]:
+        """:return: the channels which their poll time is reached"""
+        now = time.time()
+        names = []
+        while Scheduler.queue and Scheduler.queue[0][0] <= now:
+            due, name = heapq.heappop(Scheduler.queue)
+            # an old entry, the channel was rescheduled
+            if Scheduler.due_times.get(name) != due:
+                continue
+            del Scheduler.due_times[name]
+            names.append(name)
+        return names
+
+    @staticmethod
+    async def wait_next(until: float = None):
+        """
+        Wait until the next channel is due, or a channel is scheduled
+        :param until: timestamp, stop waiting at this time even if no channel is due
+        """
+        if Scheduler.changed is None:
+            Scheduler.changed = asyncio.Event()
+        Scheduler.changed.clear()
+        next_times = [due for due in (Scheduler.queue[0][0] if Scheduler.queue else None, until) if due is not None]
+        timeout = min(next_times) - time.time() if next_times else None
+        if timeout is not None and timeout <= 0:
+            return
+        try:
+            await asyncio.wait_for(Scheduler.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    @staticmethod
+    def hinted_interval(hints: dict):
+        """
+        The minimum interval asked by the feed, by `ttl` (minutes) or `sy:updatePeriod` and `sy:updateFrequency`
+        :return: interval in seconds, None if the feed has no hint
+        """
+        intervals = []
+        ttl = str(hints.get('ttl') or '').strip()
+        if ttl.isdigit() and int(ttl) > 0:
+            intervals.append(int(ttl) * 60)
+        period = Scheduler.update_periods.get(str(hints.get('update_period') or '').strip().lower())
+        if period:
+            frequency = str(hints.get('update_frequency') or '1').strip()
+            frequency = int(frequency) if frequency.isdigit() and int(frequency) > 0 else 1
+            intervals.append(period / frequency)
+        return max(intervals) if intervals else None
+
+    @staticmethod
+    def update(name: str, data: dict = None):
+        """
+        Calculate the new interval of the channel from the result of its poll
+        :param name: channel name
+        :param data: the data of the Scraper, with the keys `number_of_news`, `number_of_skipped` and `poll_hints`
+        (publish dates of the entries and hints of the feed). None when the feed not modified or not reached.
+        """
+        interval = Scheduler.intervals.get(name, Scheduler.default_interval)
+        hints = (data or {}).get('poll_hints', {})
+        new_news = (data or {}).get('number_of_news', 0)
+        if new_news == 0:
+            observed = interval * Scheduler.backoff_factor
+        else:
+            dates = sorted(hints.get('publish_dates', []))
+            gaps = [later - earlier for earlier, later in zip(dates, dates[1:]) if later > earlier]
+            if gaps:
+                # time the feed takes to publish `target_new_news` news
+                observed = sum(gaps) / len(gaps) * Scheduler.target_new_news
+            else:
+                observed = interval
+            # more new news than wanted, the last poll was late
+            observed = min(observed, interval * Scheduler.target_new_news / new_news)
+        interval = Scheduler.smoothing * observed + (1 - Scheduler.smoothing) * interval
+        if hints:
+            Scheduler.hinted_intervals[name] = Scheduler.hinted_interval(hints)
+        hinted = Scheduler.hinted_intervals.get(name)
+        minimum = max(Scheduler.min_interval, hinted or 0)
+        interval = min(max(interval, minimum), max(Scheduler.max_interval, minimum))
+        Scheduler.intervals[name] = interval
+        logger.info(f"Channel {name}: {new_news} new news, next poll after {interval:.0f}s")
+        return interval
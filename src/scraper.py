@@ -1,71 +1,221 @@
-import feedparser
+import calendar
 import httpx
 import time
-from lxml import html
 from urllib import parse
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import src.logging_config
 import logging
 from src.handle_errors import ErrorHandler
+from src.fetcher import Fetcher
+from src.image_store import ImageStore
+from src.media_extractor import MediaExtractor
+from src.media_cache import MediaCache
+from src.feed_parser import FeedParser
+from src.feed_profile import FeedProfile
+from src.buffering import Buffering
+from src.database_manager import ManageDB
+from src.metrics import Metrics
 logger = logging.getLogger("Scraper")
 
 
 class Scraper:
-    number_of_image = 0
+    # size of the chunks of the articles read to get their image
+    media_chunk_size = 16 * 1024
+    # {'articles': number of articles read, 'bytes_read': bytes downloaded, 'bytes_saved': bytes not downloaded}
+    media_stats = {'articles': 0, 'bytes_read': 0, 'bytes_saved': 0}
+    # extensions of the media of the feed without type
+    image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.bmp', '.svg')
+    # the sources of the images in the feed, in the order they are tried
+    media_sources = ('media_thumbnail', 'media_content', 'enclosures', 'html')
+    standard_date_format = "%Y-%m-%d %H:%M:%S"
+    # the formats of the dates of the feeds, the format of a feed is learned in its profile
+    date_parsers = {
+        'standard': lambda date: datetime.strptime(date, Scraper.standard_date_format),
+        'rfc822_gmt': lambda date: datetime.strptime(date, "%a, %d %b %Y %H:%M:%S GMT").replace(tzinfo=timezone.utc),
+        'rfc822_offset': lambda date: datetime.strptime(date, "%a, %d %b %Y %H:%M:%S %z"),
+        'rfc822': parsedate_to_datetime,
+        'iso8601': datetime.fromisoformat,
+    }
+
     @staticmethod
-    def __convert_date_to_utc(date: str):
+    def __convert_date_to_utc(date: str, rss_url: str = None):
         """
-        This function convert a date any in timezone to UTC
+        This function convert a date any in timezone to UTC. The format learned for the feed is tried first, the other
+        formats only if it fails. A date without offset is in the timezone learned from the other dates of the feed, UTC
+        if the feed has no date with offset.
         :param date: str object represent the date scraped
-        :return: str object the UTC date associate to date
+        :param rss_url: the URL of the feed, used to get and save its date format and timezone
+        :return: str object the UTC date associate to date, the date without change if no format match it, None if
+        the entry has no date (the Cleaner rejects the news)
         """
-        import pytz
-
-        def check_format(format_: str):
+        if not date:
+            return None
+        date = date.strip()
+        profile = FeedProfile.get(rss_url) if rss_url else {}
+        learned = profile.get('date_format')
+        names = [learned] if learned in Scraper.date_parsers else []
+        names += [name for name in Scraper.date_parsers if name != learned]
+        for name in names:
             try:
-                datetime.strptime(date, format_)
-                return True
-            except ValueError:
-                return False
-
-        standard_format = "%Y-%m-%d %H:%M:%S"
-        date_format = "%a, %d %b %Y %H:%M:%S"
-        if check_format(standard_format):
-            return date
-        if 'GMT' in date:
-            date = date.replace('GMT', '').strip()
-            return datetime.strptime(date, date_format).strftime(standard_format)
-        local_time = datetime.strptime(date, '%a, %d %b %Y %H:%M:%S %z')
-        utc_time = local_time.astimezone(pytz.utc)
-        formatted_utc_time = utc_time.strftime(standard_format)
-        return utc_time.strftime(formatted_utc_time)
-
-    @staticmethod
-    async def get_rss_data(content, channel_rss: tuple):
+                parsed = Scraper.date_parsers[name](date)
+            except (TypeError, ValueError):
+                continue
+            changed = {'date_format': name} if name != learned else {}
+            if parsed.tzinfo is not None:
+                offset = parsed.strftime('%z')
+                if offset != profile.get('timezone'):
+                    changed['timezone'] = offset
+                parsed = parsed.astimezone(timezone.utc)
+            elif profile.get('timezone'):
+                learned_timezone = datetime.strptime(profile['timezone'], '%z').tzinfo
+                parsed = parsed.replace(tzinfo=learned_timezone).astimezone(timezone.utc)
+            if rss_url and changed:
+                FeedProfile.update(rss_url, **changed)
+            return parsed.strftime(Scraper.standard_date_format)
+        logger.error(f"Date <{date}> of {rss_url} has unknown format")
+        return date
+
+    @staticmethod
+    def parse_feed(content, parser: str = 'lxml'):
+        """
+        Parse the RSS file
+        :param content: bytes object that contains RSS feed
+        :param parser: 'lxml' the fast parser (feedparser used if the feed is malformed), or 'feedparser'
+        :return: the feed parsed, in the form of the result of feedparser
+        """
+        return FeedParser.parse(content, parser)
+
+    @staticmethod
+    def get_poll_hints(rss_feed) -> dict:
+        """:return: the information of the feed used by the Scheduler to calculate the poll interval of the channel"""
+        return {
+            'ttl': rss_feed.feed.get('ttl'),
+            'update_period': rss_feed.feed.get('sy_updateperiod'),
+            'update_frequency': rss_feed.feed.get('sy_updatefrequency'),
+            'publish_dates': [calendar.timegm(entry.published_parsed) for entry in rss_feed.entries
+                              if entry.get('published_parsed')],
+        }
+
+    @staticmethod
+    async def drop_saved_entries(entries: list, rss_url: str) -> list:
+        """
+        Drop the entries already saved in the database, and the entries repeated in the feed
+        :param entries: the entries of the feed
+        :param rss_url: the URL of the RSS feed, used in the logs
+        :return: the new entries
+        """
+        entries = [entry for entry in entries if entry.get('link')]
+        new_links = await ManageDB.filter_new_links([entry.link for entry in entries])
+        new_entries = []
+        for entry in entries:
+            # a link repeated in the feed is kept once
+            if entry.link in new_links:
+                new_links.discard(entry.link)
+                new_entries.append(entry)
+        logger.info(f"{len(entries) - len(new_entries)} news already saved skipped from {rss_url}")
+        return new_entries
+
+    @staticmethod
+    async def resolve_media(entry, base_url: str, rss_url: str = None):
+        """
+        :param entry: entry of the feed
+        :param base_url: base url of the channel
+        :param rss_url: the URL of the feed, used to get and save its profile
+        :return: the URL of the image of the news, from the feed or from the article
+        """
+        media = Scraper.feed_media(entry, base_url, rss_url)
+        if media:
+            return media
+        return await Scraper.article_media(entry.link, base_url, rss_url)
+
+    @staticmethod
+    def feed_media(entry, base_url: str = None, rss_url: str = None):
+        """
+        Get the image of the news from the RSS feed, in order: `media:thumbnail`, `media:content`, the enclosures and the
+        first image of the summary or the content. The source learned for the feed is tried first.
+        :param entry: entry of the feed
+        :param base_url: used to joined with link of the image, default the link of the news
+        :param rss_url: the URL of the feed, used to get and save the source of its images
+        :return: the URL of the image of the news if it exists in the RSS feed, else None
+        """
+        base_url = base_url or entry.get('link', '')
+        learned = FeedProfile.get(rss_url).get('media_source') if rss_url else None
+        sources = [learned] if learned in Scraper.media_sources else []
+        sources += [source for source in Scraper.media_sources if source != learned]
+        for source in sources:
+            media = Scraper.__source_media(source, entry, base_url)
+            if media:
+                if rss_url and source != learned:
+                    FeedProfile.update(rss_url, media_source=source)
+                return media
+        return None
+
+    @staticmethod
+    def __source_media(source: str, entry, base_url: str):
+        """:return: the URL of the image of the entry in one source of the feed, else None"""
+        if source == 'media_thumbnail':
+            for thumbnail in entry.get('media_thumbnail') or []:
+                if thumbnail.get('url'):
+                    logger.debug("Media exist in the RSS feed")
+                    return parse.urljoin(base_url, thumbnail['url'])
+        elif source == 'media_content':
+            for content in entry.get('media_content') or []:
+                if content.get('url') and \
+                        Scraper.__is_image(content.get('url'), content.get('type'), content.get('medium')):
+                    return parse.urljoin(base_url, content['url'])
+        elif source == 'enclosures':
+            for enclosure in entry.get('enclosures') or []:
+                if enclosure.get('href') and Scraper.__is_image(enclosure.get('href'), enclosure.get('type')):
+                    return parse.urljoin(base_url, enclosure['href'])
+        elif source == 'html':
+            texts = [entry.get('summary')] + [content.get('value') for content in entry.get('content') or []]
+            for text in texts:
+                if text and '<img' in text:
+                    extractor = MediaExtractor(base_url)
+                    media = extractor.feed(text.encode()) or extractor.close()
+                    if media:
+                        return media
+        return None
+
+    @staticmethod
+    def __is_image(url: str, type_: str = None, medium: str = None) -> bool:
+        """The media of the feed is an image by its medium, its type or the extension of its URL"""
+        if medium:
+            return medium == 'image'
+        if type_:
+            return type_.startswith('image/')
+        return parse.urlparse(url).path.lower().endswith(Scraper.image_extensions)
+
+    @staticmethod
+    def build_news(entry, media=None, rss_url: str = None) -> dict:
+        """:return: the news of the entry, in the structure used by the Cleaner and the database"""
+        return {
+            'title': entry.get('title'),
+            'link': entry.get('link'),
+            'publish_date': Scraper.__convert_date_to_utc(entry.get('published'), rss_url),
+            'description': entry.get('summary'),
+            'media': media,
+        }
+
+    @staticmethod
+    async def get_rss_data(content, channel_rss: tuple, parser: str = 'lxml'):
         """
         Function that parse the RSS file to retrieve the data
         :param content: bytes object that contains RSS feed
         :param channel_rss: a tuple with two elements `rss url` and `base url of the channel`
+        :param parser: the parser of the feed, see `parse_feed`
         :return: dict object that contains the status of the data and news.
         """
-        news = []
-        rss_feed = feedparser.parse(content)
+        rss_feed = Scraper.parse_feed(content, parser)
         rss_url = channel_rss[-1]
-        for entry in rss_feed.entries:
-            if entry.get('media_thumbnail', None):
-                logger.info("Media exist in the RSS feed")
-                media = entry.media_thumbnail[0].get('url')
-            else:
-                media = await Scraper.get_media(entry.link, channel_rss[0])
-            news.append(
-                {
-                    'title': entry.title,
-                    'link': entry.link,
-                    'publish_date': Scraper.__convert_date_to_utc(entry.published),
-                    'description': entry.summary,
-                    'media': media,
-                },
-            )
+        FeedProfile.update_item_count(rss_url, len(rss_feed.entries))
+        # drop the news already saved before any request
+        new_entries = await Scraper.drop_saved_entries(rss_feed.entries, rss_url)
+        news = []
+        for entry in new_entries:
+            media = await Scraper.resolve_media(entry, channel_rss[0], rss_url)
+            news.append(Scraper.build_news(entry, media, rss_url))
         logger.info(f"Scrape news successfully from {rss_url}")
         return {
             'status': True,
@@ -73,7 +223,9 @@ class Scraper:
                 'work_on': rss_url,
                 'channel_url': channel_rss[0],
                 'date': time.time(),
-                'number_of_news': len(rss_feed.entries),
+                'number_of_news': len(news),
+                'number_of_skipped': len(rss_feed.entries) - len(news),
+                'poll_hints': Scraper.get_poll_hints(rss_feed),
                 'news': news,
             }
         }
@@ -82,36 +234,184 @@ class Scraper:
     async def get_media(article_url: str, base_url: str):
         """
         Some RSS files did not integrate base image of the article, this function used to get the image
-        from the article.
+        from the article. The article is read by chunks and the download stopped when the image is found, the article
+        is downloaded all only when the website refuse the request (error 403 handled by the ErrorHandler).
         :param article_url: the URL where to get the image
         :param base_url: this parameter used to joined with link of the image
         :return: image url
         """
+        _, media, _ = await Scraper.read_article_media(article_url, base_url)
+        return media
+
+    @staticmethod
+    async def read_article_media(article_url: str, base_url: str, access: str = 'direct') -> tuple:
+        """
+        Get the image of the article, the same as `get_media`
+        :param access: how the articles of the channel are reached, if 'cookies' or 'browser' the article is not
+        requested without cookies
+        :return: tuple (reached, media, access), reached is False if the article not reached, media is None if no image,
+        access is the way the article is reached
+        """
         logger.info(f"Start getting media from the article page <{article_url}>")
-        content = await ErrorHandler.handle_403(article_url)
+        extractor = MediaExtractor(base_url)
+        if access in ('cookies', 'browser'):
+            result = await Scraper.__read_protected_article_media(article_url, extractor, access)
+            if result[0]:
+                return result
+            # the way learned failed, the article is requested without cookies
+            extractor = MediaExtractor(base_url)
+        try:
+            async with Fetcher.stream(article_url, 'article') as response:
+                if response.status_code == 200:
+                    media = None
+                    async for chunk in response.aiter_bytes(Scraper.media_chunk_size):
+                        media = extractor.feed(chunk)
+                        if media:
+                            break
+                    media = media or extractor.close()
+                    Scraper.__count_media_bytes(article_url, response, media is not None)
+                    if media:
+                        logger.info(f"Get media successfully for url:<{article_url}> ")
+                    else:
+                        logger.debug(f"Media no get it for url:<{article_url}>")
+                    return True, media, 'direct'
+                logger.info(f"Status code <{response.status_code}> when getting media from <{article_url}>")
+                if response.status_code in (404, 410):
+                    # the article does not exist, saved in the cache as an article without image
+                    return True, None, 'direct'
+        except httpx.HTTPError as e:
+            logger.error(f"Exception when getting media from <{article_url}>: {e}")
+            return False, None, 'direct'
+        if access in ('cookies', 'browser'):
+            return False, None, None
+        return await Scraper.__read_protected_article_media(article_url, extractor)
+
+    @staticmethod
+    async def __read_protected_article_media(article_url: str, extractor: MediaExtractor, access: str = None):
+        """Get the image of an article that refuse the requests without cookies"""
+        content, access = await ErrorHandler.get_protected_content(article_url, access)
         if content:
-            doc = html.fromstring(content)
-            media_url = doc.xpath("//img[1]/@src")
-            if media_url:
+            media = extractor.feed(content.encode() if isinstance(content, str) else content) or extractor.close()
+            if media:
                 logger.info(f"Get media successfully for url:<{article_url}> ")
-                return parse.urljoin(base_url, media_url[0])
-            logger.debug(f"Media no get it for url:<{article_url}>")
-            return None
+            else:
+                logger.debug(f"Media no get it for url:<{article_url}>")
+            return True, media, access
         logger.debug(f"Media no get it for url:<{article_url}>")
-        return None
+        return False, None, None
 
     @staticmethod
-    async def get_news(rss_url: tuple, headers=None, proxy=None) -> dict:
+    async def article_media(article_url: str, base_url: str, rss_url: str = None):
         """
-        This function sed request to the rss url -> rss_url[1] a check the status code of the response to return
-        the dict object either with status True that mean this dict has news data or False mean there are a problem.
+        Get the image of the article from the media cache, the article is requested only if it is not in the cache.
+        The articles reached are saved in the cache, with or without image.
+        :param article_url: the URL of the article
+        :param base_url: used to joined with link of the image
+        :param rss_url: the URL of the feed of the article, used to get and save how its articles are reached
+        :return: image url, None if the article has no image
+        """
+        found, media = MediaCache.get(article_url)
+        if found:
+            logger.debug(f"Media of <{article_url}> found in the cache")
+            Metrics.inc('media_total', result='cache')
+            return media
+        started = time.perf_counter()
+        learned = FeedProfile.get(rss_url).get('article_access', 'direct') if rss_url else 'direct'
+        reached, media, access = await Scraper.read_article_media(article_url, base_url, learned)
+        if reached:
+            MediaCache.put(article_url, media)
+            if rss_url and access != learned:
+                FeedProfile.update(rss_url, article_access=access)
+        result = 'not_reached' if not reached else 'found' if media else 'no_image'
+        Metrics.observe('media_seconds', time.perf_counter() - started, access=access, result=result)
+        Metrics.inc('media_total', result=result)
+        return media
+
+    @staticmethod
+    def __count_media_bytes(article_url: str, response: httpx.Response, stopped: bool):
+        """Count the bytes of the articles not downloaded because the image was found before the end"""
+        bytes_read = response.num_bytes_downloaded
+        length = response.headers.get('content-length', '')
+        saved = max(int(length) - bytes_read, 0) if stopped and length.isdigit() else 0
+        Scraper.media_stats['articles'] += 1
+        Scraper.media_stats['bytes_read'] += bytes_read
+        Scraper.media_stats['bytes_saved'] += saved
+        Metrics.inc('media_bytes_read_total', bytes_read)
+        Metrics.inc('media_bytes_saved_total', saved)
+        logger.debug(f"<{article_url}>: {bytes_read} bytes read, {saved} bytes not downloaded")
+
+    @staticmethod
+    def get_validators(rss_url: str) -> dict:
+        """
+        Build the conditional headers of the RSS feed from the validators (ETag, Last-Modified) saved in the last run
+        :param rss_url: the URL of the RSS feed
+        :return: dict object of headers, empty if the feed has no validators saved
+        """
+        if not Buffering.feed_validators_buffer:
+            Buffering.feed_validators_buffer = Buffering.open_feed_validators_buffer()
+        validators = Buffering.feed_validators_buffer.get_item(rss_url, {})
+        headers = {}
+        if validators.get('etag'):
+            headers['if-none-match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['if-modified-since'] = validators['last_modified']
+        return headers
+
+    @staticmethod
+    async def save_validators(rss_url: str, validators: dict):
+        """
+        Save the validators of the RSS feed, call it only after the news of the feed are saved, so a feed not saved
+        is downloaded again in the next run
+        :param rss_url: the URL of the RSS feed
+        :param validators: dict object with keys `etag` and `last_modified`
+        """
+        if not validators or not any(validators.values()):
+            return
+        if not Buffering.feed_validators_buffer:
+            Buffering.feed_validators_buffer = Buffering.open_feed_validators_buffer()
+        Buffering.feed_validators_buffer.set_item(rss_url, validators)
+        logger.info(f"Validators of {rss_url} saved")
+
+    @staticmethod
+    async def fetch_feed(rss_url: tuple, headers=None, proxy=None) -> dict:
+        """
+        Send the request to the rss url -> rss_url[1] without parsing it. The request is conditional, if the feed not
+        changed since the last run the error is 304.
         :param rss_url: a tuple with two elements `rss url` and `base url of the channel`
         :param headers: request headers
         :param proxy: used to send request using proxy
-        :return: the state of the data and news data if the status key is True
+        :return: dict object with status True and the `content` of the feed, or status False and the error
         """
+        access = FeedProfile.get(rss_url[-1]).get('access', 'direct')
+        if access in ('cookies', 'browser'):
+            # the feed refused the requests without cookies the last time
+            content, access = await ErrorHandler.get_protected_content(rss_url[-1], access)
+            if content:
+                return {
+                    'status': True,
+                    'data': {
+                        'channel_url': rss_url[0],
+                        'work_on': rss_url[-1],
+                        'date': time.time(),
+                        'content': content,
+                        'validators': {},
+                    }
+                }
+            FeedProfile.update(rss_url[-1], access='direct')
         try:
-            response = httpx.get(rss_url[-1], headers=headers, follow_redirects=True, timeout=60)
+            headers = {**(headers or {}), **Scraper.get_validators(rss_url[-1])}
+            response = await Fetcher.get(rss_url[-1], 'rss', headers=headers)
+            if response.status_code == 304:
+                logger.info(f"RSS feed {rss_url[-1]} not modified since the last run")
+                return {
+                    'status': False,
+                    'data': {
+                        'channel_url': rss_url[0],
+                        'work_on': rss_url[-1],
+                        'date': time.time(),
+                        'error': 304,
+                    }
+                }
             if response.status_code != 200:
                 logger.debug(f"News did not scraped from {rss_url[-1]}, status code<{response.status_code}>")
                 return {
@@ -125,7 +425,19 @@ class Scraper:
                         'proxy': proxy,
                     }
                 }
-            return await Scraper.get_rss_data(response.content, rss_url)
+            return {
+                'status': True,
+                'data': {
+                    'channel_url': rss_url[0],
+                    'work_on': rss_url[-1],
+                    'date': time.time(),
+                    'content': response.content,
+                    'validators': {
+                        'etag': response.headers.get('etag'),
+                        'last_modified': response.headers.get('last-modified'),
+                    },
+                }
+            }
         except httpx.HTTPError as e:
             logger.error(f"Exception: {e}")
             return {
@@ -139,21 +451,33 @@ class Scraper:
                 }
 
     @staticmethod
-    async def save_image(image_link: str, channel_name: str):
-        import os
-        directory_exist = os.path.exists(f"images/{channel_name}")
-        try:
-            response = httpx.get(image_link)
-            logger.info(f"Saving image for <{image_link}> with status code {response.status_code}")
-            if not directory_exist:
-                os.makedirs(f"images/{channel_name}")
-                Scraper.number_of_image = 0
-            else:
-                Scraper.number_of_image = len(os.listdir(f"images/{channel_name}"))
-            Scraper.number_of_image += 1
-            with open(f'images/{channel_name}/image_{Scraper.number_of_image}.png', 'wb') as image:
-                image.write(response.content)
-            return f"{os.path.abspath('images/')}/{channel_name}/image_{Scraper.number_of_image}.png".replace('\\', '/')
-        except httpx.HTTPError as e:
-            logger.error(f"Image link:<{image_link}> not added Exception : {e}")
-            return None
+    async def get_news(rss_url: tuple, headers=None, proxy=None) -> dict:
+        """
+        This function sed request to the rss url -> rss_url[1] a check the status code of the response to return
+        the dict object either with status True that mean this dict has news data or False mean there are a problem.
+        The request is conditional, if the feed not changed since the last run the error is 304 and nothing is parsed.
+        :param rss_url: a tuple with two elements `rss url` and `base url of the channel`
+        :param headers: request headers
+        :param proxy: used to send request using proxy
+        :return: the state of the data and news data if the status key is True
+        """
+        result = await Scraper.fetch_feed(rss_url, headers, proxy)
+        if not result['status']:
+            return result
+        data = await Scraper.get_rss_data(result['data']['content'], rss_url)
+        data['data']['validators'] = result['data']['validators']
+        return data
+
+    @staticmethod
+    async def save_image(image_link: str):
+        """
+        Download the image of a news and save it in the image store
+        :param image_link: URL of the image
+        :return: the absolute path of the image, None if not saved
+        """
+        return await ImageStore.save(image_link)
+
+    @staticmethod
+    async def save_images(news: list[dict]):
+        """Download the images of the news in the same time, the path of every image saved in `media_path`"""
+        await ImageStore.save_all(news)
@@ -0,0 +1,223 @@
+import json
+import time
+import redis.asyncio as redis
+import logging
+import src.logging_config
+
+logger = logging.getLogger("WorkQueue")
+
+# the scripts run in Redis in one time, no other client change the keys in the middle
+PUSH_SCRIPT = """
+local pushed = 0
+for _, name in ipairs(ARGV) do
+    if redis.call('SADD', KEYS[1], name) == 1 then
+        redis.call('LPUSH', KEYS[2], name)
+        pushed = pushed + 1
+    end
+end
+return pushed
+"""
+LEASE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+for _, name in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    redis.call('ZREM', KEYS[2], name)
+    redis.call('HDEL', KEYS[3], name)
+    redis.call('RPUSH', KEYS[1], name)
+end
+local name = redis.call('RPOP', KEYS[1])
+if not name then
+    return false
+end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), name)
+redis.call('HSET', KEYS[3], name, ARGV[1])
+return name
+"""
+EXTEND_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+return 1
+"""
+ACK_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('SREM', KEYS[3], ARGV[1])
+redis.call('RPUSH', KEYS[4], ARGV[3])
+return 1
+"""
+
+
+class WorkQueue:
+    """
+    The queue of the channels shared by the coordinator and the workers of many processes or machines, in Redis.
+    The coordinator push the channels due, a worker lease a channel, scrape it and acknowledge it with the result of the
+    poll (read by the coordinator to schedule the next poll). A lease expire after `lease_timeout` seconds if the worker
+    does not extend it, the channel is given to another worker: the channels of a crashed worker are not lost.
+    The links of the news saved are added to a shared set, so a worker skip the news saved by the others before
+    downloading their images. A link is added only after its news is inserted: a worker crashed does not hide news, and
+    two workers saving the same news in the same time are handled by the database (the news exist is skipped).
+    Keys (prefix 'scrape_news'):
+        <prefix>:pending   list of the channels waiting a worker
+        <prefix>:queued    set of the channels pending or leased, a channel is pushed one time
+        <prefix>:leases    sorted set of the channels leased by their expiration time (ms)
+        <prefix>:owners    hash of the worker of every channel leased
+        <prefix>:results   list of the results of the polls, JSON {'name', 'result'}
+        <prefix>:seen      set of the links of the news saved
+    """
+    # seconds a channel stay leased without extension
+    lease_timeout = 300
+    # the stand-ins of the process by URL, used by `connect('memory://')`
+    memory_queues: dict = {}
+
+    def __init__(self, client: redis.Redis, prefix: str = 'scrape_news', lease_timeout: float = None):
+        self.client = client
+        self.lease_timeout = lease_timeout or WorkQueue.lease_timeout
+        self.keys = {key: f"{prefix}:{key}" for key in ('pending', 'queued', 'leases', 'owners', 'results', 'seen')}
+        self.push_script = client.register_script(PUSH_SCRIPT)
+        self.lease_script = client.register_script(LEASE_SCRIPT)
+        self.extend_script = client.register_script(EXTEND_SCRIPT)
+        self.ack_script = client.register_script(ACK_SCRIPT)
+
+    @staticmethod
+    def connect(url: str, prefix: str = 'scrape_news', lease_timeout: float = None):
+        """
+        :param url: the URL of Redis like 'redis://localhost:6379/0', or 'memory://' for the stand-in in the process
+        (the coordinator and the workers in the same process)
+        :return: the work queue
+        """
+        if url.startswith('memory://'):
+            if url not in WorkQueue.memory_queues:
+                WorkQueue.memory_queues[url] = MemoryWorkQueue(lease_timeout)
+            return WorkQueue.memory_queues[url]
+        logger.info(f"Work queue in Redis <{url}> with prefix {prefix}")
+        return WorkQueue(redis.from_url(url, decode_responses=True), prefix, lease_timeout)
+
+    async def push(self, names: list[str]) -> int:
+        """Add the channels to the queue, the channels pending or leased are skipped. :return: number of channels added"""
+        if not names:
+            return 0
+        return await self.push_script(keys=[self.keys['queued'], self.keys['pending']], args=names)
+
+    async def lease(self, worker: str):
+        """
+        Take the next channel, the channels of the expired leases are given first
+        :param worker: the id of the worker
+        :return: the channel name, None if the queue is empty
+        """
+        return await self.lease_script(keys=[self.keys['pending'], self.keys['leases'], self.keys['owners']],
+                                       args=[worker, int(self.lease_timeout * 1000)])
+
+    async def extend(self, name: str, worker: str) -> bool:
+        """Extend the lease of the channel, :return: False if the lease is lost (expired and given to another worker)"""
+        return bool(await self.extend_script(keys=[self.keys['leases'], self.keys['owners']],
+                                             args=[name, worker, int(self.lease_timeout * 1000)]))
+
+    async def ack(self, name: str, worker: str, result: dict = None) -> bool:
+        """
+        The channel is scraped, its lease is removed and the result is given to the coordinator
+        :param result: the result of the poll, JSON serializable (None if the feed not modified or not reached)
+        :return: False if the lease is lost, the result is dropped
+        """
+        return bool(await self.ack_script(
+            keys=[self.keys['leases'], self.keys['owners'], self.keys['queued'], self.keys['results']],
+            args=[name, worker, json.dumps({'name': name, 'result': result})]))
+
+    async def results(self) -> list[tuple[str, dict]]:
+        """:return: the results of the polls acknowledged since the last call, list of (name, result)"""
+        async with self.client.pipeline(transaction=True) as pipe:
+            items, _ = await pipe.lrange(self.keys['results'], 0, -1).delete(self.keys['results']).execute()
+        return [(item['name'], item['result']) for item in map(json.loads, items)]
+
+    async def unseen_links(self, links: list[str]) -> set[str]:
+        """:return: the links not in the seen set, their news are not saved by a worker"""
+        if not links:
+            return set()
+        seen = await self.client.smismember(self.keys['seen'], links)
+        return {link for link, found in zip(links, seen) if not found}
+
+    async def add_links(self, links: list[str]):
+        """Add the links of the news saved to the seen set"""
+        if links:
+            await self.client.sadd(self.keys['seen'], *links)
+
+    async def size(self) -> dict:
+        """:return: number of channels pending and leased"""
+        async with self.client.pipeline(transaction=False) as pipe:
+            pending, leased = await pipe.llen(self.keys['pending']).zcard(self.keys['leases']).execute()
+        return {'pending': pending, 'leased': leased}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class MemoryWorkQueue:
+    """
+    Stand-in of `WorkQueue` in the memory of the process, the same functions and the same behaviour, used to run the
+    coordinator and workers in one process or to try the distributed mode without Redis.
+    """
+    def __init__(self, lease_timeout: float = None):
+        self.lease_timeout = lease_timeout or WorkQueue.lease_timeout
+        self.pending: list[str] = []
+        self.queued: set[str] = set()
+        # {name: (expiration time, worker)}
+        self.leases: dict[str, tuple[float, str]] = {}
+        self.results_: list[tuple[str, dict]] = []
+        self.seen: set[str] = set()
+
+    async def push(self, names: list[str]) -> int:
+        pushed = 0
+        for name in names:
+            if name not in self.queued:
+                self.queued.add(name)
+                self.pending.append(name)
+                pushed += 1
+        return pushed
+
+    async def lease(self, worker: str):
+        now = time.time()
+        expired = sorted((expiration, name) for name, (expiration, _) in self.leases.items() if expiration <= now)
+        for _, name in expired:
+            del self.leases[name]
+            self.pending.insert(0, name)
+        if not self.pending:
+            return None
+        name = self.pending.pop(0)
+        self.leases[name] = (now + self.lease_timeout, worker)
+        return name
+
+    async def extend(self, name: str, worker: str) -> bool:
+        if self.leases.get(name, (0, None))[1] != worker:
+            return False
+        self.leases[name] = (time.time() + self.lease_timeout, worker)
+        return True
+
+    async def ack(self, name: str, worker: str, result: dict = None) -> bool:
+        if self.leases.get(name, (0, None))[1] != worker:
+            return False
+        del self.leases[name]
+        self.queued.discard(name)
+        self.results_.append((name, result))
+        return True
+
+    async def results(self) -> list[tuple[str, dict]]:
+        results, self.results_ = self.results_, []
+        return results
+
+    async def unseen_links(self, links: list[str]) -> set[str]:
+        return set(links) - self.seen
+
+    async def add_links(self, links: list[str]):
+        self.seen.update(links)
+
+    async def size(self) -> dict:
+        return {'pending': len(self.pending), 'leased': len(self.leases)}
+
+    async def close(self):
+        pass